@@ -3,21 +3,38 @@
 
 #Contact: David Duan <david.3.duan@microsoft.com>
 
+import abc
+import collections
 import getopt
+import gzip
+import hashlib
+import heapq
+import io
+import json
 import logging
+import mmap
 import os
+import queue
 import re
 import shutil
+import sqlite3
 import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 from xml.etree import ElementTree as etree
 
-#logfile settings
-logging.basicConfig(
-    filename='newabc.log',
-    filemode='w',
-    format='%(asctime)s  :  %(message)s',
-    level=logging.INFO
-)
+#logger, configured by setup_logging() from the command line options
+LOGGER = logging.getLogger("newabc")
+LOGGER.addHandler(logging.NullHandler())
+LOG_FORMAT = '%(asctime)s  :  %(message)s'
+LOG_FILE = 'newabc.log'     # --log-file option, '-' means stderr, '' means no log
+LOG_LEVEL = logging.INFO    # --log-level option
+QUIET = False               # -q/--quiet option, no console output except errors
 
 #global variables
 
@@ -29,9 +46,106 @@ COUNTRY_MCC_FILE = os.path.join(TOOL_PATH, "cfg", "country_mcc.txt")
 SETTINGS_PATH = os.path.join(TOOL_PATH, "cfg", "Settings")
 VARIANT_APPLICATIONS_APPNAME = []
 VARIANT_APPLICATIONS_APPNAME_BGCOLOR = {}
+VARIANT_APPLICATIONS_APPNAME_SET = set()    # same names as VARIANT_APPLICATIONS_APPNAME, for the membership checks
+JOBS = 4    # worker threads of the generation task graph, -j option
+ARCHIVE = ""    # -a option, stream the generated files into this zip/tar archive instead of OUTPUT
+CATALOG = ""    # --catalog option, SQLite database updated with what the run resolved, see CatalogWriter
+FOOTPRINT = ""  # --footprint option, JSON report of the media bytes each sub region and CTR ships, see media_footprint_report()
+FOOTPRINT_HASH = False  # --footprint-hash option, also sha256 the media files of the footprint report
+MEDIA_STAT_CACHE = "media_stat_cache.json"  # --media-cache option, {media path: size, mtime, sha256} of the previous runs, '' disables it
+SHARD = None    # --shard option, (shard index, shard count), the index starts at 1
+SHARD_PLAN = {} # {(product, "config-set"/"variant", sub region/CTR): shard index}, every work item of the run
+OUTPUT_WRITER = None    # where write_output_file() puts the generated files, see open_output_writer()
+CATALOG_WRITER = None   # CatalogWriter of the --catalog option, gets the rows of every rendered config-set
+IO_THREADS = 2          # --io-threads option, threads writing the generated files behind the render, 0 writes directly
+IO_QUEUE_SIZE = 64      # --io-queue option, rendered files waiting for the writer threads before render blocks
+FSYNC = "none"          # --fsync option, none, file (each file once written) or end (all files at the end of the run)
+TEMPLATE_CONTENT = {}   # {template path: template text}, templates are read once per run
+COUNTRY_MCC_INFO = {}   # {country mcc file: get_country_mcc_info() tables}
+STORAGE_MEDIA_FILES = {}    # {(storage folder, product): get_storage_media_files() sets}
+PRODUCT_STORAGE_MEDIA_FILES = {}    # {(storage folder, product): {media folder: file names of the product folder only}}
+MMAP_MIN_SIZE = 0          # settings files from this size are scanned in place through mmap, 0: never (default), see iter_variant_setting_records()
+SETTINGS_INDEX = {}     # {settings folder: SettingsIndex}, see get_settings_index()
+SETTINGS_INDEX_LOCK = threading.Lock()
+RENDER_CACHE = collections.OrderedDict()    # {config_set_fingerprint(): (render_config_set_fragments() result, size)}, least recently used first
+RENDER_CACHE_SIZE = 0                       # characters held by RENDER_CACHE
+RENDER_CACHE_MAX_SIZE = 32 << 20            # least recently used bodies are dropped above this
+RENDER_CACHE_LOCK = threading.Lock()
+
+#per-run summary counters, instead of logging every single item
+RUN_STATS = collections.Counter()
+MISSING_MEDIA = {}  # {media_type: {media_item: reference count}}
+RUN_STATS_LOCK = threading.Lock()
+
+def setup_logging(log_level=None, log_file=None, quiet=None):
+    """
+    Configure the tool logger, the log file is written from scratch on every run.
 
-logging.info("TOOL_PATH: %s", TOOL_PATH)
-logging.info("TEMPLATE_PATH: %s", TEMPLATE_PATH)
+    Args:
+        log_level: logging level, DEBUG dumps all the parsed tables
+        log_file: log file path, '-' logs to stderr, '' disables logging
+        quiet: True, only errors are printed on the console
+    Return:
+        None
+    """
+    global LOG_LEVEL
+    global LOG_FILE
+    global QUIET
+
+    if log_level is not None:
+        LOG_LEVEL = log_level
+    if log_file is not None:
+        LOG_FILE = log_file
+    if quiet is not None:
+        QUIET = quiet
+
+    for handler in LOGGER.handlers[:]:
+        LOGGER.removeHandler(handler)
+        handler.close()
+
+    if LOG_FILE == '-':
+        handler = logging.StreamHandler(sys.stderr)
+    elif LOG_FILE:
+        handler = logging.FileHandler(LOG_FILE, mode='w')
+    else:
+        handler = logging.NullHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(LOG_LEVEL if LOG_FILE else logging.CRITICAL + 1)
+    LOGGER.propagate = False
+
+def console(text):
+    """
+    Print progress info on the console, unless quiet mode.
+    """
+    if not QUIET:
+        print(text)
+
+def count_run_stat(name, number=1):
+    with RUN_STATS_LOCK:
+        RUN_STATS[name] += number
+
+def report_missing_media(media_type, media_item):
+    """
+    Remember a missing media file for the run summary, instead of warning on every sub region.
+    """
+    with RUN_STATS_LOCK:
+        RUN_STATS["missing media"] += 1
+        missing_items = MISSING_MEDIA.setdefault(media_type, {})
+        missing_items[media_item] = missing_items.get(media_item, 0) + 1
+    LOGGER.debug("Warning: No %s file named \"%s\"", media_type, media_item)
+
+def log_run_summary():
+    """
+    Log the per-run counters and print the missing media files, once per file.
+    """
+    with RUN_STATS_LOCK:
+        for media_type in sorted(MISSING_MEDIA):
+            missing_items = MISSING_MEDIA[media_type]
+            text = "Warning: No %s file named %s" % (media_type, ", ".join('"%s"' % item for item in sorted(missing_items)))
+            LOGGER.warning("%s (%d references)", text, sum(missing_items.values()))
+            console(text)
+        LOGGER.info("[run summary] %s", ", ".join("%s: %d" % (name, RUN_STATS[name]) for name in sorted(RUN_STATS)))
 
 def multi_replace(text, adict):
     rx = re.compile('|'.join(map(re.escape, adict)))
@@ -39,19 +153,366 @@ def multi_replace(text, adict):
         return adict[match.group(0)]
     return rx.sub(xlat, text)
 
-def update_template_content(file_path, pairs):
+def read_template_content(file_path):
     """
-    Update file content, replace the placeholder in the tempalte file.
+    Read a template file, once per run.
+
     Args:
         file_path:
+    Return:
+        template text
+    """
+    if file_path not in TEMPLATE_CONTENT:
+        with open(file_path) as f:
+            TEMPLATE_CONTENT[file_path] = f.read()
+    return TEMPLATE_CONTENT[file_path]
+
+def fill_template_content(text, pairs):
+    """
+    Replace the placeholders in the template text.
+
+    Args:
+        text:
         pairs:
+    Return:
+        new text
+    """
+    return multi_replace(text, pairs)
+
+class OutputWriter(abc.ABC):
+    """
+    Base of the generated files writers, keeps the manifest (path, size, sha256) of everything written.
+    Writers implement write(), close() when they have something to finish and abort() when they
+    have something to clean up after a failed run.
+
+    Args:
+        is_hashed: True, the manifest gets the sha256 of the files (archives and shard manifests need it),
+                   False, only path and size
+    """
+    def __init__(self, is_hashed):
+        self.is_hashed = is_hashed
+        self.manifest_entries = {}
+        self.lock = threading.Lock()
+
+    def record(self, relative_path, data):
+        """
+        Add a file to the manifest, its sha256 is added by digest() where the file is written.
+        """
+        with self.lock:
+            if relative_path in self.manifest_entries:
+                print("Error: [OutputWriter] %s generated twice!!" % relative_path)
+                sys.exit()
+            self.manifest_entries[relative_path] = {"path": relative_path, "size": len(data)}
+
+    def digest(self, relative_path, data):
+        if self.is_hashed:
+            sha256 = hashlib.sha256(data).hexdigest()
+            with self.lock:
+                self.manifest_entries[relative_path]["sha256"] = sha256
+
+    def manifest(self):
+        """
+        Return:
+            manifest: {"files": [{"path": ..., "size": ...[, "sha256": ...]}, ...]}, sorted by path
+        """
+        return {"files": [self.manifest_entries[path] for path in sorted(self.manifest_entries)]}
+
+    @abc.abstractmethod
+    def write(self, relative_path, text):
+        """
+        Args:
+            relative_path: athena/config-sets/EURO_RU-config-data.xml (example), relative to OUTPUT
+            text: generated file content
+        """
+
+    def close(self):
+        pass
+
+    def abort(self):
+        """
+        Called instead of close() when the run fails, drops what can't be completed.
+        """
+        pass
+
+def fsync_file(file_path):
+    """
+    Flush a written file to the disk.
+    """
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class DirectoryOutput(OutputWriter):
+    """
+    Write every generated file under the output folder: {OUTPUT}/{product}/config-sets/*.xml ...
+    """
+    def __init__(self, output_path, is_hashed=False):
+        OutputWriter.__init__(self, is_hashed)
+        self.output_path = output_path
+        self.folders = set()
+
+    def write(self, relative_path, text):
+        data = text.encode("utf-8")
+        self.record(relative_path, data)
+        self.write_file(relative_path, data)
+
+    def write_file(self, relative_path, data):
+        file_path = os.path.join(self.output_path, relative_path)
+        folder_path = os.path.dirname(file_path)
+        if folder_path not in self.folders:
+            if not os.path.isdir(folder_path):
+                try:
+                    os.makedirs(folder_path)
+                except OSError:
+                    if not os.path.isdir(folder_path): # created meanwhile by another task
+                        raise
+            self.folders.add(folder_path)
+
+        with open(file_path, 'wb') as f:
+            f.write(data)
+            if FSYNC == "file":
+                f.flush()
+                os.fsync(f.fileno())
+        self.digest(relative_path, data)
+
+    def close(self):
+        if FSYNC == "end":
+            for relative_path in sorted(self.manifest_entries):
+                fsync_file(os.path.join(self.output_path, relative_path))
+            for folder_path in self.folders:
+                fsync_file(folder_path)
+
+class WriteBehindOutput(DirectoryOutput):
+    """
+    DirectoryOutput writing behind the render: write() only queues the file, a few writer
+    threads drain the queue. The queue is bounded, render blocks when the disk can't follow.
+    The first write error is raised back in the run, by the next write() or by close().
+    Writer threads are always stopped and joined, by close() after the last file, or by abort()
+    after dropping the files still queued.
+    """
+    def __init__(self, output_path, io_threads, queue_size, is_hashed=False):
+        DirectoryOutput.__init__(self, output_path, is_hashed)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.error = None
+        self.is_error_reported = False
+        self.threads = []
+        for i in range(io_threads):
+            thread = threading.Thread(target=self.drain, name="writer-%d" % i)
+            thread.start()
+            self.threads.append(thread)
+
+    def drain(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            relative_path, data = item
+            if self.error is None: # after an error, only empty the queue so that write() never blocks forever
+                try:
+                    self.write_file(relative_path, data)
+                except Exception as err:
+                    self.error = (relative_path, err)
+
+    def raise_error(self):
+        if self.error is not None:
+            with self.lock:
+                if not self.is_error_reported: # render threads all stop on the same error
+                    relative_path, err = self.error
+                    print("Error: [WriteBehindOutput] %s not written: %s" % (relative_path, err))
+                    LOGGER.error("[WriteBehindOutput] %s not written: %s", relative_path, err)
+                    self.is_error_reported = True
+            sys.exit(1)
+
+    def write(self, relative_path, text):
+        self.raise_error()
+        data = text.encode("utf-8")
+        self.record(relative_path, data)
+        self.queue.put((relative_path, data))
+
+    def stop_threads(self):
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def close(self):
+        self.stop_threads()
+        self.raise_error()
+        DirectoryOutput.close(self)
+
+    def abort(self):
+        # the run failed, nothing writes any more: the queued files are dropped, the file in hand is finished
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.stop_threads()
+
+class ArchiveOutput(OutputWriter):
+    """
+    Pack the generated files into one zip or tar archive instead of the output folder.
+
+    Every file is written into the open archive as soon as it is generated, under the writer lock,
+    so none of them stays in memory or on the disk outside the archive; close() appends a manifest.json
+    as the last member. The archive type comes from the file name: .zip (deflated), .tar,
+    .tar.gz/.tgz, .tar.bz2, .tar.xz. Members get fixed timestamps/owners and come in generation order,
+    so with -j 1 the same inputs always give the same archive; with more jobs the members and their
+    contents are the same, only their order can change.
+    The archive is written aside, to <archive>.tmp, and moved in place by close(), abort() removes it.
+    """
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, archive_path):
+        OutputWriter.__init__(self, True)   # manifest.json lists the sha256 of the members
+        self.archive_path = archive_path
+        self.temp_path = archive_path + ".tmp"
+        self.archive = None
+        self.fileobjs = []      # files under the archive, closed after it
+        if archive_path.endswith(".zip"):
+            self.archive_type = "zip"
+        elif archive_path.endswith((".tar.gz", ".tgz")):
+            self.archive_type = "gz"
+        elif archive_path.endswith(".tar.bz2"):
+            self.archive_type = "bz2"
+        elif archive_path.endswith(".tar.xz"):
+            self.archive_type = "xz"
+        elif archive_path.endswith(".tar"):
+            self.archive_type = "tar"
+        else:
+            print("Error: [ArchiveOutput] unknown archive type: %s, use .zip .tar .tar.gz .tgz .tar.bz2 or .tar.xz" % archive_path)
+            sys.exit(2)
+
+    def open_archive(self):
+        if self.archive_type == "zip":
+            self.archive = zipfile.ZipFile(self.temp_path, "w", zipfile.ZIP_DEFLATED)
+            return
+        f = open(self.temp_path, "wb")
+        self.fileobjs.append(f)
+        if self.archive_type == "gz":
+            fileobj = gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0)
+            self.fileobjs.insert(0, fileobj)
+            self.archive = tarfile.open(fileobj=fileobj, mode="w", format=tarfile.PAX_FORMAT)
+        elif self.archive_type == "tar":
+            self.archive = tarfile.open(fileobj=f, mode="w", format=tarfile.PAX_FORMAT)
+        else:
+            self.archive = tarfile.open(fileobj=f, mode="w|" + self.archive_type, format=tarfile.PAX_FORMAT)
+
+    def add_member(self, name, data):
+        """
+        Called under the writer lock.
+        """
+        if self.archive is None:
+            self.open_archive()
+        if self.archive_type == "zip":
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self.archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = 0
+            self.archive.addfile(info, io.BytesIO(data))
+
+    def write(self, relative_path, text):
+        data = text.encode("utf-8")
+        self.record(relative_path, data)
+        self.digest(relative_path, data)
+        with self.lock:
+            self.add_member(relative_path.replace(os.sep, "/"), data)
+
+    def close_archive(self):
+        try:
+            if self.archive is not None:
+                self.archive.close()
+        finally:
+            self.archive = None
+            for fileobj in self.fileobjs:
+                fileobj.close()
+            self.fileobjs = []
+
+    def close(self):
+        manifest_data = json.dumps(self.manifest(), indent=1, sort_keys=True).encode("utf-8")
+        with self.lock:
+            self.add_member(self.MANIFEST_NAME, manifest_data)
+            self.close_archive()
+        if FSYNC != "none":
+            fsync_file(self.temp_path)
+        os.replace(self.temp_path, self.archive_path)
+
+        LOGGER.info("[ArchiveOutput] %d files written into %s", len(self.manifest_entries), self.archive_path)
+
+    def abort(self):
+        with self.lock:
+            try:
+                self.close_archive()
+            finally:
+                if os.path.exists(self.temp_path):
+                    os.remove(self.temp_path)
+
+def open_output_writer():
+    """
+    Set up OUTPUT_WRITER from the OUTPUT, ARCHIVE, IO_THREADS and SHARD options (only shard manifests need
+    the sha256 of the files), close() it at the end of the run.
+
+    Return:
+        OUTPUT_WRITER
+    """
+    global OUTPUT_WRITER
+
+    if ARCHIVE:
+        OUTPUT_WRITER = ArchiveOutput(ARCHIVE)
+    elif IO_THREADS > 0:
+        OUTPUT_WRITER = WriteBehindOutput(OUTPUT, IO_THREADS, IO_QUEUE_SIZE, bool(SHARD))
+    else:
+        OUTPUT_WRITER = DirectoryOutput(OUTPUT, bool(SHARD))
+    return OUTPUT_WRITER
+
+def write_output_file(relative_path, text):
+    """
+    Hand a generated file over to the output writer.
+
+    Args:
+        relative_path: athena/config-sets/EURO_RU-config-data.xml (example), relative to OUTPUT
+        text: generated file content
     Return:
         None
     """
-    text = open(file_path).read()
-    newtext = multi_replace(text, pairs)
-    if newtext != text:
-        open(file_path, 'w').write(newtext)
+    global OUTPUT_WRITER
+
+    if OUTPUT_WRITER is None: # generate_*_files() called on their own, nobody to close a write-behind writer
+        OUTPUT_WRITER = ArchiveOutput(ARCHIVE) if ARCHIVE else DirectoryOutput(OUTPUT, bool(SHARD))
+    OUTPUT_WRITER.write(relative_path, text)
+
+def get_storage_media_files(product_name):
+    """
+    List the media files of the common and product storage folders, once per product.
+
+    Args:
+        product_name:
+    Return:
+        videos_file_list, audio_file_list, images_file_list : sets of file names
+    """
+    storage_key = (STORAGE_PATH, product_name)
+    if storage_key not in STORAGE_MEDIA_FILES:
+        media_files = []
+        product_media_files = {}
+        for media_folder in ("videos", "audio", "images"):
+            file_list = set(os.listdir(os.path.join(STORAGE_PATH, "common", media_folder)))
+            product_media_storage_path = os.path.join(STORAGE_PATH, product_name, media_folder)
+            product_media_files[media_folder] = set()
+            if os.path.isdir(product_media_storage_path):
+                product_media_files[media_folder].update(os.listdir(product_media_storage_path))
+                file_list.update(product_media_files[media_folder])
+            media_files.append(file_list)
+        PRODUCT_STORAGE_MEDIA_FILES[storage_key] = product_media_files
+        STORAGE_MEDIA_FILES[storage_key] = tuple(media_files)
+    return STORAGE_MEDIA_FILES[storage_key]
 
 def check_media_data(product_name, media_type, media_item):
     """
@@ -66,88 +527,123 @@ def check_media_data(product_name, media_type, media_item):
     """
 
     is_availability = False
+    count_run_stat("media checked")
 
-    common_videos_storage_path = os.path.join(STORAGE_PATH, "common", "videos")
-    common_audio_storage_path = os.path.join(STORAGE_PATH, "common", "audio")
-    common_images_storage_path = os.path.join(STORAGE_PATH, "common", "images")
-    product_videos_storage_path = os.path.join(STORAGE_PATH, product_name, "videos")
-    product_audio_storage_path = os.path.join(STORAGE_PATH, product_name, "audio")
-    product_images_storage_path = os.path.join(STORAGE_PATH, product_name, "images")
-
-    videos_file_list = os.listdir(common_videos_storage_path)
-    if os.path.isdir(product_videos_storage_path):
-        videos_file_list = os.listdir(product_videos_storage_path) + videos_file_list
-
-    audio_file_list = os.listdir(common_audio_storage_path)
-    if os.path.isdir(product_audio_storage_path):
-        audio_file_list = os.listdir(product_audio_storage_path) + audio_file_list
-
-    images_file_list = os.listdir(common_images_storage_path)
-    if os.path.isdir(product_images_storage_path):
-        images_file_list = os.listdir(product_images_storage_path) + images_file_list
+    videos_file_list, audio_file_list, images_file_list = get_storage_media_files(product_name)
 
     if media_type == "AlertTones":
         if media_item in audio_file_list:
             is_availability = True
         else:
-            print("Warning: No " + media_type + " file named \"" + media_item + "\"")
-            logging.info("Warning: No " + media_type + " file named \"" + media_item + "\"")
+            report_missing_media(media_type, media_item)
             is_availability = False
     elif media_type == "MiscTones":
         if media_item in audio_file_list:
             is_availability = True
         else:
-            print("Warning: No " + media_type + " file named \"" + media_item + "\"")
-            logging.info("Warning: No " + media_type + " file named \"" + media_item + "\"")
+            report_missing_media(media_type, media_item)
             is_availability = False
     elif media_type == "RingingTones":
         if media_item in audio_file_list:
             is_availability = True
         else:
-            print("Warning: No " + media_type + " file named \"" + media_item + "\"")
-            logging.info("Warning: No " + media_type + " file named \"" + media_item + "\"")
+            report_missing_media(media_type, media_item)
             is_availability = False
     elif media_type == "Music":
         if media_item in audio_file_list:
             is_availability = True
         else:
-            print("Warning: No " + media_type + " file named \"" + media_item + "\"")
-            logging.info("Warning: No " + media_type + " file named \"" + media_item + "\"")
+            report_missing_media(media_type, media_item)
             is_availability = False
     elif media_type == "ParallaxBackground":
         if media_item in images_file_list:
             is_availability = True
         else:
-            print("Warning: No " + media_type + " file named \"" + media_item + "\"")
-            logging.info("Warning: No " + media_type + " file named \"" + media_item + "\"")
+            report_missing_media(media_type, media_item)
             is_availability = False
     elif media_type == "LockscreenWallpaper":
         if media_item in images_file_list:
             is_availability = True
         else:
-            print("Warning: No " + media_type + " file named \"" + media_item + "\"")
-            logging.info("Warning: No " + media_type + " file named \"" + media_item + "\"")
+            report_missing_media(media_type, media_item)
             is_availability = False
     elif media_type == "Animations":
         if media_item in images_file_list:
             is_availability = True
         else:
-            print("Warning: No " + media_type + " file named \"" + media_item + "\"")
-            logging.info("Warning: No " + media_type + " file named \"" + media_item + "\"")
+            report_missing_media(media_type, media_item)
             is_availability = False
     elif media_type == "Videos":
         if media_item in videos_file_list:
             is_availability = True
         else:
-            print("Warning: No " + media_type + " file named \"" + media_item + "\"")
-            logging.info("Warning: No " + media_type + " file named \"" + media_item + "\"")
+            report_missing_media(media_type, media_item)
             is_availability = False
     else:
         print("no such kind of media type: %s in the storage folder" % media_type)
+        LOGGER.warning("no such kind of media type: %s in the storage folder", media_type)
 
     return is_availability
 
 
+VARIANT_SETTING_PATTERN = re.compile(r'<VariantSetting\s*packageId="(.+)"\s*settingId="(.+)"\s*value="(.+)"\s*/>')
+# same record on the raw bytes of a whole file: whitespace never crosses a line end, "." already doesn't
+VARIANT_SETTING_BYTES_PATTERN = re.compile(rb'<VariantSetting[^\S\n]*packageId="(.+)"[^\S\n]*settingId="(.+)"[^\S\n]*value="(.+)"[^\S\n]*/>')
+
+def iter_file_lines(file_path):
+    """
+    Stream the lines of an input file, only one line is in memory at a time.
+
+    Args:
+        file_path:
+    Return:
+        generator of the lines, line end included
+    """
+    with open(file_path) as f:
+        for line in f:
+            yield line
+
+def iter_variant_setting_records(file_path):
+    """
+    Stream the <VariantSetting packageId="" settingId="" value="" /> records of a settings file,
+    one per line, only one line is in memory at a time.
+
+    With MMAP_MIN_SIZE set (--mmap-min-size), files of that size or more are scanned in place through
+    mmap instead and only the matched lines are copied out. It is faster on big files with few records
+    among other lines, slower on files made of records, so it is off by default. Both give the same records.
+
+    Args:
+        file_path:
+    Return:
+        generator of (stripped setting line, packageId, settingId, value)
+    """
+    file_size = os.path.getsize(file_path)
+    if file_size == 0 or not MMAP_MIN_SIZE or file_size < MMAP_MIN_SIZE:
+        for line in iter_file_lines(file_path):
+            line = line.strip()
+            line_m = VARIANT_SETTING_PATTERN.search(line)
+            if line_m: #skip meaningless lines, not start with "<VariantSetting packageId=....."
+                yield line, line_m.group(1), line_m.group(2), line_m.group(3)
+        return
+
+    with open(file_path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = 0
+            while True:
+                line_m = VARIANT_SETTING_BYTES_PATTERN.search(data, position)
+                if not line_m:
+                    break
+                line_start = data.rfind(b"\n", 0, line_m.start()) + 1
+                line_end = data.find(b"\n", line_m.end())
+                if line_end == -1:
+                    line_end = file_size
+                yield (data[line_start:line_end].strip().decode("utf-8"),
+                       line_m.group(1).decode("utf-8"), line_m.group(2).decode("utf-8"), line_m.group(3).decode("utf-8"))
+                position = line_end # one record per line, like the line by line scan
+        finally:
+            data.close()
+
 def find_codelist_and_content_configure_data_files(type_designator):
     """
     find correct codelist and content_configure_date files in the abc_regionphone folder.
@@ -178,10 +674,10 @@ def find_codelist_and_content_configure_data_files(type_designator):
 
     content_configure_data = codelist.replace("codelist",'content_configure_data')
 
-    logging.info("[find_codelist_and_content_configure_data_files] product_name = %s " % product_name )
-    logging.info("[find_codelist_and_content_configure_data_files] product_nick_name = %s " % product_nick_name )
-    logging.info("[find_codelist_and_content_configure_data_files] codelist = %s " % codelist )
-    logging.info("[find_codelist_and_content_configure_data_files] content_configure_data = %s " % content_configure_data )
+    LOGGER.debug("[find_codelist_and_content_configure_data_files] product_name = %s ", product_name)
+    LOGGER.debug("[find_codelist_and_content_configure_data_files] product_nick_name = %s ", product_nick_name)
+    LOGGER.debug("[find_codelist_and_content_configure_data_files] codelist = %s ", codelist)
+    LOGGER.debug("[find_codelist_and_content_configure_data_files] content_configure_data = %s ", content_configure_data)
 
     return product_name, product_nick_name, codelist, content_configure_data
 
@@ -257,7 +753,119 @@ def variant_config_sets_collect(ctr_code, codelist, variant_ctrcode_to_subregion
 
     return variant_config_sets_content_text
 
-def variant_settings_collect(type_designator, product_name, product_nick_name, sv_sub_region):
+class SettingsIndex(object):
+    """
+    Index of the cfg/Settings folder, built from a single scan of the folder.
+
+    Settings files are looked up by (level, region, sub_region, product, ds_ss):
+
+        ("PRODUCT", None, None, None, None)          Settings_PRODUCT.xml
+        ("PRODUCT", None, None, "athena", None)      Settings_PRODUCT_athena.xml
+        ("DS/SS", None, None, None, "DS")            Settings_DS.xml
+        ("DS/SS", None, None, "athena", "SS")        Settings_SS_athena.xml
+        ("MV", "LTA", None, None, None)              Settings_MV_LATAM.xml
+        ("MV", "EURO", None, "athena", None)         Settings_MV_EUROathena.xml
+        ("SV", "LTA", "LTA_BR", None, None)          Settings_SV_LATAM_BR.xml
+        ("SV", "EURO", "EURO_RU", "athena", None)    Settings_SV_EURO_RU_athena.xml
+
+    Sub region and product names both contain "_", so the file names can't be split back
+    into keys, keys are turned into file names instead and resolved against the scanned names.
+    Lookups and whole cascades are memoized, the index is shared by all products of the process.
+    """
+    def __init__(self, settings_path):
+        self.settings_path = settings_path
+        self.file_names = set()
+        self.files = {}      # {key: file name or None}
+        self.cascades = {}   # {(product_name, ds_ss, sub_region): [file name, ...]}
+        self.file_sizes = {} # {file name: size in bytes}
+
+        if os.path.isdir(settings_path):
+            self.file_names = set(os.listdir(settings_path))
+
+        LOGGER.info("[SettingsIndex] %d files in %s", len(self.file_names), settings_path)
+
+    @staticmethod
+    def file_name(level, region=None, sub_region=None, product=None, ds_ss=None):
+        """
+        Return:
+            setting file name of the key, LTA region files are named LATAM
+        """
+        if level == "PRODUCT":
+            setting_file = "Settings_PRODUCT" + ("_" + product if product else "") + ".xml"
+        elif level == "DS/SS":
+            setting_file = "Settings_" + ds_ss + ("_" + product if product else "") + ".xml"
+        elif level == "MV":
+            mv = "LATAM" if region == "LTA" else region
+            setting_file = "Settings_MV_" + mv + (product if product else "") + ".xml"
+        elif level == "SV":
+            setting_file = "Settings_SV_" + sub_region + ("_" + product if product else "") + ".xml"
+            if region == "LTA":
+                setting_file = setting_file.replace("LTA", "LATAM")
+        else:
+            print("Error: [SettingsIndex] no such settings level: %s" % level)
+            sys.exit()
+        return setting_file
+
+    def lookup(self, level, region=None, sub_region=None, product=None, ds_ss=None):
+        """
+        Return:
+            setting file name, None if there is no such file in the settings folder
+        """
+        key = (level, region, sub_region, product, ds_ss)
+        if key not in self.files:
+            setting_file = self.file_name(*key)
+            self.files[key] = setting_file if setting_file in self.file_names else None
+        return self.files[key]
+
+    def file_size(self, setting_file):
+        """
+        Return:
+            size of a settings file in bytes, stat once
+        """
+        if setting_file not in self.file_sizes:
+            self.file_sizes[setting_file] = os.path.getsize(os.path.join(self.settings_path, setting_file))
+        return self.file_sizes[setting_file]
+
+    def cascade(self, product_name, product_nick_name, sv_sub_region):
+        """
+        Return:
+            existing settings file names of a sub region, in the variant_settings_collect cascade order
+        """
+        if "_ds" in product_nick_name:
+            ds_ss = "DS"
+        elif "_ss" in product_nick_name:
+            ds_ss = "SS"
+        else:
+            ds_ss = None
+
+        sub_region = sv_sub_region.split(">")[1]     #Strip the "SV>" from "SV>EURO_RU"
+        region = sub_region.split("_")[0]
+
+        cascade_key = (product_name, ds_ss, sub_region)
+        if cascade_key not in self.cascades:
+            keys = [("PRODUCT", None, None, None, None),
+                    ("PRODUCT", None, None, product_name, None)]
+            if ds_ss:
+                keys += [("DS/SS", None, None, None, ds_ss),
+                         ("DS/SS", None, None, product_name, ds_ss)]
+            keys += [("MV", region, None, None, None),
+                     ("MV", region, None, product_name, None),
+                     ("SV", region, sub_region, None, None),
+                     ("SV", region, sub_region, product_name, None)]
+            self.cascades[cascade_key] = [setting_file for setting_file in (self.lookup(*key) for key in keys) if setting_file]
+        return self.cascades[cascade_key]
+
+def get_settings_index():
+    """
+    Return:
+        SettingsIndex of SETTINGS_PATH, the folder is scanned only once per process
+    """
+    with SETTINGS_INDEX_LOCK:
+        if SETTINGS_PATH not in SETTINGS_INDEX:
+            SETTINGS_INDEX[SETTINGS_PATH] = SettingsIndex(SETTINGS_PATH)
+        return SETTINGS_INDEX[SETTINGS_PATH]
+
+def variant_settings_resolve(type_designator, product_name, product_nick_name, sv_sub_region):
     """
     collect all setting files content cascadingly according to this order:
 
@@ -277,95 +885,55 @@ def variant_settings_collect(type_designator, product_name, product_nick_name, s
         sv_sub_region :
 
     Returns:
-        variantsettings_content_text :
+        variantsettings_content : {settingId: (setting line, settings file)}, in cascade order, see read_setting_line
 
     """
-    variantsettings_content = []
-    variantsettings_file_list = []
-    variantsettings_content_text = ""
-
-    #PRODUCT
-    setting_file = "Settings_PRODUCT.xml"
-    if os.path.exists(os.path.join(SETTINGS_PATH, setting_file)):
-        variantsettings_file_list = [setting_file]
-
-    #PRODUCT_{product}
-    setting_file = "Settings_PRODUCT_" + product_name + ".xml"
-    if os.path.exists(os.path.join(SETTINGS_PATH, setting_file)):
-        variantsettings_file_list.append(setting_file)
-
-    #DS/SS
-    if "_ds" in product_nick_name:
-        setting_file = "Settings_DS.xml"
-    elif "_ss" in product_nick_name:
-        setting_file = "Settings_SS.xml"
-    if os.path.exists(os.path.join(SETTINGS_PATH, setting_file)):
-        variantsettings_file_list.append(setting_file)
-
-    #DS/SS_{product}
-    if "_ds" in product_nick_name:
-        setting_file = "Settings_DS_" + product_name + ".xml"
-    elif "_ss" in product_nick_name:
-        setting_file = "Settings_SS_" + product_name + ".xml"
-    if os.path.exists(os.path.join(SETTINGS_PATH, setting_file)):
-        variantsettings_file_list.append(setting_file)
-
-    #MV
-    sub_region = sv_sub_region.split(">")[1]     #Strip the "SV>" from "SV>EURO_RU"
-    mv = sub_region.split("_")[0]
-    if mv == "LTA":
-        mv = "LATAM"
-    setting_file = "Settings_MV_" + mv + ".xml"
-    if os.path.exists(os.path.join(SETTINGS_PATH, setting_file)):
-        variantsettings_file_list.append(setting_file)
-
-    #MV_{product}
-    setting_file = "Settings_MV_" + mv + product_name + ".xml"
-    if os.path.exists(os.path.join(SETTINGS_PATH, setting_file)):
-        variantsettings_file_list.append(setting_file)
-
-    #SV
-    sub_region = sv_sub_region.split(">")[1]
-    mv = sub_region.split("_")[0]
-    setting_file = "Settings_SV_" + sub_region + ".xml"
-    if mv == "LTA":
-        setting_file = setting_file.replace("LTA", "LATAM")
-    if os.path.exists(os.path.join(SETTINGS_PATH, setting_file)):
-        variantsettings_file_list.append(setting_file)
-
-    #SV_{product}
-    setting_file = "Settings_SV_" + sub_region + "_" + product_name + ".xml"
-    if mv == "LTA":
-        setting_file = setting_file.replace("LTA", "LATAM")
-    if os.path.exists(os.path.join(SETTINGS_PATH, setting_file)):
-        variantsettings_file_list.append(setting_file)
-
-    logging.info("[variant_settings_collect]:%s variantsettings_file_list is %s" % (sv_sub_region, variantsettings_file_list))
+    variantsettings_file_list = get_settings_index().cascade(product_name, product_nick_name, sv_sub_region)
+
+    LOGGER.debug("[variant_settings_resolve]:%s variantsettings_file_list is %s", sv_sub_region, variantsettings_file_list)
+
+    return read_variant_settings_files(variantsettings_file_list)
+
+def read_variant_settings_files(variantsettings_file_list):
+    """
+    Read the settings files in cascade order, a setting of a later file overrides the same settingId of the earlier ones.
+
+    Args:
+        variantsettings_file_list: ['Settings_PRODUCT.xml', 'Settings_DS.xml', 'Settings_MV_EURO.xml'] (example)
+
+    Returns:
+        variantsettings_content : {settingId: (setting line, settings file)}, in cascade order, see read_setting_line
+    """
+    variantsettings_content = {}    # the later file in the cascade wins
+
+    count_run_stat("settings files read", len(variantsettings_file_list))
 
     for item in variantsettings_file_list:
         item_path = os.path.join(SETTINGS_PATH,item)
-        if os.path.exists(item_path):
-            with open(item_path) as f:
-                for line in f.readlines():
-                    if not line.split(): #skip blank line
-                        pass
-                    else:
-                        line = line.strip()
-                        line_m = re.search('<VariantSetting\s*packageId="(.+)"\s*settingId="(.+)"\s*value="(.+)"\s*/>', line)
-                        if line_m: #skip meaningless lines, not start with "<VariantSetting packageId=....."
-                            line_settingId = line_m.group(2)
-                            line_value = line_m.group(3)
-                            for inneritem in variantsettings_content:
-                                innerline_m = re.search('<VariantSetting\s*packageId="(.+)"\s*settingId="(.+)"\s*value="(.+)"\s*/>', inneritem.strip())
-                                if innerline_m:
-                                    innerline_settingId = innerline_m.group(2)
-                                    innerline_value = innerline_m.group(3)
-                                    if line_settingId == innerline_settingId:
-                                        variantsettings_content.remove(inneritem)
-
-                            variantsettings_content.append(line)
-
-    variantsettings_content_text = "\n".join(list(set(variantsettings_content)))
+        for line, line_packageId, line_settingId, line_value in iter_variant_setting_records(item_path):
+            variantsettings_content.pop(line_settingId, None) # overridden setting moves to the end
+            variantsettings_content[line_settingId] = (line, item) # packageId and value only kept by the line, see read_setting_line
+
+    return variantsettings_content
+
+def read_setting_line(line):
+    """
+    Args:
+        line: <VariantSetting packageId="com.a" settingId="b" value="c" /> (example), a read_variant_settings_files() setting line
+    Return:
+        (packageId, settingId, value)
+    """
+    return VARIANT_SETTING_PATTERN.search(line).groups()
+
+def variant_settings_collect(type_designator, product_name, product_nick_name, sv_sub_region):
+    """
+    collect all setting files content cascadingly, see variant_settings_resolve
+
+    Returns:
+        variantsettings_content_text :
+    """
+    variantsettings_content = variant_settings_resolve(type_designator, product_name, product_nick_name, sv_sub_region)
+    variantsettings_content_text = "\n".join(setting[0] for setting in variantsettings_content.values())
 
     return variantsettings_content_text
 
@@ -395,65 +963,52 @@ def get_codelist_info(codelist):
     variant_region = {}
     country_set = {}
     sd_card = {}
-    variant_subregions = []
     variant_ctrcode_to_subregions = {}
     variant_subregion_to_ctrcode = {}
+    sv_variant_info = {}    # {ctr code: [SV line variant_info, ...]}, in file order
 
     if os.path.exists(codelist):
-        with open(codelist) as f:
-            for line in f.readlines():
-                lineinfo = line.strip().split("|")
-                variant_info = re.split('\s+', lineinfo[0])
-                if line.startswith('#') or not line.split(): #skip comment line and blank line
-                    pass
-                elif line.startswith('MV'):
-                    mv_ctr_code = variant_info[2]
-                    ctr_code_list.append(mv_ctr_code)
-                    variant_region[mv_ctr_code] = variant_info[5:]
-                    country_set[mv_ctr_code] = variant_info[3]
-                    sd_card[mv_ctr_code] = lineinfo[1]
-                elif line.startswith('SV'):
-                    pass
-                else:
-                    print("Error: Code list line does not start with SV or MV or has blank lines\n")
-                    sys.exit()
+        for line in iter_file_lines(codelist):
+            lineinfo = line.strip().split("|")
+            variant_info = re.split('\s+', lineinfo[0])
+            if line.startswith('#') or not line.split(): #skip comment line and blank line
+                pass
+            elif line.startswith('MV'):
+                mv_ctr_code = variant_info[2]
+                ctr_code_list.append(mv_ctr_code)
+                variant_region[mv_ctr_code] = variant_info[5:]
+                country_set[mv_ctr_code] = variant_info[3]
+                sd_card[mv_ctr_code] = lineinfo[1]
+            elif line.startswith('SV'):
+                sv_variant_info.setdefault(variant_info[2], []).append(variant_info)
+            else:
+                print("Error: Code list line does not start with SV or MV or has blank lines\n")
+                sys.exit()
 
     for each_ctr_code in ctr_code_list:
         variant_ctrcode_to_subregions[each_ctr_code] = []
-        if os.path.exists(codelist):
-            with open(codelist) as f:
-                for line in f.readlines():
-                    lineinfo = line.strip().split("|")
-                    variant_info = re.split('\s+', lineinfo[0])
-                    if line.startswith('#') or not line.split(): #skip comment line and blank line
-                        pass
-                    elif line.startswith('MV'):
-                        pass
-                    elif line.startswith('SV'):
-                        if each_ctr_code == variant_info[2]:
-                            variant_sub_region_part = variant_info[-1].split(",") # GREECE,CYPRUS,FRANCE,ITALY,SPAIN
-                            country_short_name_list = []
-                            for item in variant_sub_region_part:
-                                country_short_name_list.append(get_country_short_name(item))
-                            temp = variant_info[-2] + "_" + ("_".join(sorted(country_short_name_list))) # EURO_CY_ES_FR_GR_IT
-                            variant_ctrcode_to_subregions[each_ctr_code].append(temp)
-                            variant_subregion_to_ctrcode[temp] = variant_info[1]
-                    else:
-                        print("Error: Code list line does not start with SV or MV or has blank lines\n")
-                        sys.exit()
-
-    logging.info("[get_codelist_info] ctr_code_list = %s", ctr_code_list)
-    logging.info("[get_codelist_info] variant_region = %s", variant_region)
-    logging.info("[get_codelist_info] country_set = %s", country_set)
-    logging.info("[get_codelist_info] sd_card = %s", sd_card)
-    logging.info("[get_codelist_info] variant_ctrcode_to_subregions = %s", variant_ctrcode_to_subregions)
-    logging.info("[get_codelist_info] variant_subregion_to_ctrcode = %s", variant_subregion_to_ctrcode)
+        for variant_info in sv_variant_info.get(each_ctr_code, []):
+            variant_sub_region_part = variant_info[-1].split(",") # GREECE,CYPRUS,FRANCE,ITALY,SPAIN
+            country_short_name_list = []
+            for item in variant_sub_region_part:
+                country_short_name_list.append(get_country_short_name(item))
+            temp = variant_info[-2] + "_" + ("_".join(sorted(country_short_name_list))) # EURO_CY_ES_FR_GR_IT
+            variant_ctrcode_to_subregions[each_ctr_code].append(temp)
+            variant_subregion_to_ctrcode[temp] = variant_info[1]
+
+    LOGGER.info("[get_codelist_info] %d CTR codes, %d sub regions", len(ctr_code_list), len(variant_subregion_to_ctrcode))
+    LOGGER.debug("[get_codelist_info] ctr_code_list = %s", ctr_code_list)
+    LOGGER.debug("[get_codelist_info] variant_region = %s", variant_region)
+    LOGGER.debug("[get_codelist_info] country_set = %s", country_set)
+    LOGGER.debug("[get_codelist_info] sd_card = %s", sd_card)
+    LOGGER.debug("[get_codelist_info] variant_ctrcode_to_subregions = %s", variant_ctrcode_to_subregions)
+    LOGGER.debug("[get_codelist_info] variant_subregion_to_ctrcode = %s", variant_subregion_to_ctrcode)
 
     return ctr_code_list, variant_region, country_set, sd_card, variant_ctrcode_to_subregions, variant_subregion_to_ctrcode
 
 def get_country_mcc_info():
     """
-    Generate country name and mcc code look up table
+    Generate country name and mcc code look up table, the country file is read once per run.
 
     example:
         EURO COMMON:E_C:216,226,228,230,231,232,259,260,262,270,286,284
@@ -467,19 +1022,23 @@ def get_country_mcc_info():
         mcc_cshortname: {'216': 'HU', '214': 'ES', '212': 'MC',....}
 
     """
+    if COUNTRY_MCC_FILE in COUNTRY_MCC_INFO:
+        return COUNTRY_MCC_INFO[COUNTRY_MCC_FILE]
+
     clongname_cshortname = {}
     clongname_mcc = {}
     cshortname_mcc = {}
     mcc_cshortname = {}
 
     if os.path.exists(COUNTRY_MCC_FILE):
-        with open(COUNTRY_MCC_FILE) as f:
-            for line in f.readlines():
-                mcc_info = line.strip().split(":")
-                clongname_cshortname[mcc_info[0]] = mcc_info[1]
-                clongname_mcc[mcc_info[0]] = mcc_info[2]
-                cshortname_mcc[mcc_info[1]] = mcc_info[2]
-                mcc_cshortname[mcc_info[2]] = mcc_info[1]
+        for line in iter_file_lines(COUNTRY_MCC_FILE):
+            mcc_info = line.strip().split(":")
+            clongname_cshortname[mcc_info[0]] = mcc_info[1]
+            clongname_mcc[mcc_info[0]] = mcc_info[2]
+            cshortname_mcc[mcc_info[1]] = mcc_info[2]
+            mcc_cshortname[mcc_info[2]] = mcc_info[1]
+
+    COUNTRY_MCC_INFO[COUNTRY_MCC_FILE] = clongname_cshortname, clongname_mcc, cshortname_mcc, mcc_cshortname
 
     return clongname_cshortname, clongname_mcc, cshortname_mcc, mcc_cshortname
 
@@ -558,46 +1117,48 @@ def get_content_configure_data_info(content_configure_data):
     sv_sub_region_list = []
 
     if os.path.exists(content_configure_data):
-        with open(content_configure_data) as f:
-            for line in f.readlines():
-                if line.startswith('$') or not line.split(): #skip comment line and blank line
-                    pass
+        for line in iter_file_lines(content_configure_data):
+            if line.startswith('$') or not line.split(): #skip comment line and blank line
+                pass
+            else:
+                content_info = line.strip().split("-")
+                content_keyinfo = content_keyinfo_string_update(content_info[1].strip())
+
+                if content_info[0] == '#Videos':
+                    videos_content[content_keyinfo] = ''.join(content_info[2])
+                elif content_info[0] == '#Music':
+                    music_content[content_keyinfo] = ''.join(content_info[2])
+                elif content_info[0] == '#Menu':
+                    menu_content[content_keyinfo] = ''.join(content_info[2])
+                elif content_info[0] == '#Home':
+                    home_content[content_keyinfo] = ''.join(content_info[2])
+                elif content_info[0] == '#PreloadedApps':
+                    sv_sub_region_list.append(content_keyinfo)
+                    preloadedapps_content[content_keyinfo] = ''.join(content_info[2])
+                elif content_info[0] == '#LockscreenWallpaper':
+                    lockscreenwallpaper_content[content_keyinfo] = ''.join(content_info[2])
+                elif content_info[0] == '#RingingTones':
+                    ringingtones_content[content_keyinfo] = ''.join(content_info[2])
                 else:
-                    content_info = line.strip().split("-")
-                    content_keyinfo = content_keyinfo_string_update(content_info[1].strip())
-
-                    if content_info[0] == '#Videos':
-                        videos_content[content_keyinfo] = ''.join(content_info[2])
-                    elif content_info[0] == '#Music':
-                        music_content[content_keyinfo] = ''.join(content_info[2])
-                    elif content_info[0] == '#Menu':
-                        menu_content[content_keyinfo] = ''.join(content_info[2])
-                    elif content_info[0] == '#Home':
-                        home_content[content_keyinfo] = ''.join(content_info[2])
-                    elif content_info[0] == '#PreloadedApps':
-                        sv_sub_region_list.append(content_keyinfo)
-                        preloadedapps_content[content_keyinfo] = ''.join(content_info[2])
-                    elif content_info[0] == '#LockscreenWallpaper':
-                        lockscreenwallpaper_content[content_keyinfo] = ''.join(content_info[2])
-                    elif content_info[0] == '#RingingTones':
-                        ringingtones_content[content_keyinfo] = ''.join(content_info[2])
-                    else:
-                        print("Error: There is no this category: %s in %s" % (content_info[0], content_configure_data))
-                        sys.exit()
+                    print("Error: There is no this category: %s in %s" % (content_info[0], content_configure_data))
+                    sys.exit()
     else:
         print("Error:" + content_configure_data + "not found!\n")
         sys.exit()
 
-    logging.info("[get_content_configure_data_info] sv_sub_region_list = %s", sorted(set(sv_sub_region_list)))
-    logging.info("[get_content_configure_data_info] videos_content = %s", videos_content)
-    logging.info("[get_content_configure_data_info] music_content = %s", music_content)
-    logging.info("[get_content_configure_data_info] menu_content = %s", menu_content)
-    logging.info("[get_content_configure_data_info] home_content = %s", home_content)
-    logging.info("[get_content_configure_data_info] preloadedapps_content = %s", preloadedapps_content)
-    logging.info("[get_content_configure_data_info] lockscreenwallpaper_content = %s", lockscreenwallpaper_content)
-    logging.info("[get_content_configure_data_info] ringingtones_content = %s", ringingtones_content)
+    sv_sub_region_list = sorted(set(sv_sub_region_list))
+
+    LOGGER.info("[get_content_configure_data_info] %d sub regions", len(sv_sub_region_list))
+    LOGGER.debug("[get_content_configure_data_info] sv_sub_region_list = %s", sv_sub_region_list)
+    LOGGER.debug("[get_content_configure_data_info] videos_content = %s", videos_content)
+    LOGGER.debug("[get_content_configure_data_info] music_content = %s", music_content)
+    LOGGER.debug("[get_content_configure_data_info] menu_content = %s", menu_content)
+    LOGGER.debug("[get_content_configure_data_info] home_content = %s", home_content)
+    LOGGER.debug("[get_content_configure_data_info] preloadedapps_content = %s", preloadedapps_content)
+    LOGGER.debug("[get_content_configure_data_info] lockscreenwallpaper_content = %s", lockscreenwallpaper_content)
+    LOGGER.debug("[get_content_configure_data_info] ringingtones_content = %s", ringingtones_content)
 
-    return sorted(set(sv_sub_region_list)), videos_content, music_content, menu_content, home_content, preloadedapps_content, lockscreenwallpaper_content, ringingtones_content
+    return sv_sub_region_list, videos_content, music_content, menu_content, home_content, preloadedapps_content, lockscreenwallpaper_content, ringingtones_content
 
 def get_generated_variant_applications_list_info(type_designator):
     """
@@ -610,6 +1171,7 @@ def get_generated_variant_applications_list_info(type_designator):
     """
     global VARIANT_APPLICATIONS_APPNAME
     global VARIANT_APPLICATIONS_APPNAME_BGCOLOR
+    global VARIANT_APPLICATIONS_APPNAME_SET
 
     product_name, product_nick_name, codelist, content_configure_data = find_codelist_and_content_configure_data_files(type_designator)
 
@@ -621,189 +1183,429 @@ def get_generated_variant_applications_list_info(type_designator):
         if elem.tag == "VariantApplication":
             VARIANT_APPLICATIONS_APPNAME.append(elem.get('appName'))
             VARIANT_APPLICATIONS_APPNAME_BGCOLOR[elem.get('appName')] = elem.get('BGColor')
+    VARIANT_APPLICATIONS_APPNAME_SET = set(VARIANT_APPLICATIONS_APPNAME)
 
-    logging.info("etree [get_generated_variant_applications_list_info] VARIANT_APPLICATIONS_APPNAME=%s", VARIANT_APPLICATIONS_APPNAME)
-    logging.info("etree [get_generated_variant_applications_list_info] VARIANT_APPLICATIONS_APPNAME_BGCOLOR=%s", VARIANT_APPLICATIONS_APPNAME_BGCOLOR)
+    LOGGER.info("etree [get_generated_variant_applications_list_info] %d variant applications", len(VARIANT_APPLICATIONS_APPNAME))
+    LOGGER.debug("etree [get_generated_variant_applications_list_info] VARIANT_APPLICATIONS_APPNAME=%s", VARIANT_APPLICATIONS_APPNAME)
+    LOGGER.debug("etree [get_generated_variant_applications_list_info] VARIANT_APPLICATIONS_APPNAME_BGCOLOR=%s", VARIANT_APPLICATIONS_APPNAME_BGCOLOR)
 
-def generate_config_sets_files(type_designator):
+def resolve_media_content_list(media_content, each_sub_region, is_mv_only):
     """
-    generate {SubRegion}-config-data.xml file in config-sets folder
+    Cascade the PRODUCT, MV and SV media lists of a sub region.
+
+    Args:
+        media_content: {'PRODUCT': 'a.mp4/b.mp4', 'MV>EURO': 'c.mp4', 'SV>EURO_RU': 'd.mp4'} (example)
+        each_sub_region: EURO_RU (example)
+        is_mv_only: True, only MV>{region} entries match the region,
+                    False, every entry naming the region does (wallpapers, ringtones)
+    Return:
+        media_content_list: ['a.mp4', 'b.mp4', 'c.mp4', 'd.mp4'] (example)
+    """
+    region = each_sub_region.split("_")[0]
+
+    media_content_list = media_content['PRODUCT'].split("/")
+    for item in media_content.keys():
+        if item == "PRODUCT":
+            continue
+        if (not is_mv_only or item.split(">")[0] == "MV") and region in item:
+            media_content_list += media_content[item].split("/")
+        if item.split(">")[1] == each_sub_region:
+            media_content_list += media_content[item].split("/")
+
+    return media_content_list
+
+def resolve_config_set_inputs(product_name, product_nick_name, each_sv_sub_region, content_configure_data_info):
+    """
+    Cascade everything a {SubRegion}-config-data.xml file lists, before any of it is rendered.
+
+    Args:
+        product_name:
+        product_nick_name:
+        each_sv_sub_region: SV>EURO_RU (example)
+        content_configure_data_info: return value of get_content_configure_data_info
+    Returns:
+        config_set_inputs: {"Videos": ['a.mp4', ...], "Music": [...], "LockscreenWallpaper": [...], "RingingTones": [...],
+                            "PreloadedApps": ['Maps', ...], "Menu": ['Maps(#ff0000)', ...], "Home": ['Maps(1,0,0,2,1)', ...],
+                            "Settings": ['Settings_PRODUCT.xml', ...]} (example)
+    """
+    sv_sub_region_list, videos_content, music_content, menu_content, home_content, preloadedapps_content, lockscreenwallpaper_content, ringingtones_content = content_configure_data_info
+
+    each_sub_region = each_sv_sub_region.split(">")[1]     #Strip the "SV>" from "SV>EURO_RU"
+
+    config_set_inputs = {"Videos": [], "Music": [], "LockscreenWallpaper": [], "RingingTones": [],
+                         "PreloadedApps": [], "Menu": [], "Home": []}
+    if videos_content:
+        config_set_inputs["Videos"] = resolve_media_content_list(videos_content, each_sub_region, True)
+    if music_content:
+        config_set_inputs["Music"] = resolve_media_content_list(music_content, each_sub_region, True)
+    if lockscreenwallpaper_content:
+        config_set_inputs["LockscreenWallpaper"] = resolve_media_content_list(lockscreenwallpaper_content, each_sub_region, False)
+    if ringingtones_content:
+        config_set_inputs["RingingTones"] = resolve_media_content_list(ringingtones_content, each_sub_region, False)
+    if preloadedapps_content:
+        config_set_inputs["PreloadedApps"] = preloadedapps_content[each_sv_sub_region].split("/")
+    if menu_content:
+        config_set_inputs["Menu"] = menu_content[each_sv_sub_region].split("/")
+    if home_content:
+        config_set_inputs["Home"] = home_content[each_sv_sub_region].split("/")
+    config_set_inputs["Settings"] = get_settings_index().cascade(product_name, product_nick_name, each_sv_sub_region)
+
+    return config_set_inputs
+
+def config_set_fingerprint(product_name, config_set_inputs):
+    """
+    Sub regions with the same fingerprint render the same config-data.xml body, only the header differs.
+
+    Args:
+        product_name:
+        config_set_inputs: return value of resolve_config_set_inputs
+    Return:
+        fingerprint: sha1 hex digest of the resolved inputs
+    """
+    return hashlib.sha1(json.dumps([product_name, config_set_inputs], sort_keys=True).encode("utf-8")).hexdigest()
+
+def render_config_set_fragments(product_name, config_set_inputs):
+    """
+    Render the body blocks of a {SubRegion}-config-data.xml file, checking the media and applications on the way.
+
+    Args:
+        product_name:
+        config_set_inputs: return value of resolve_config_set_inputs
+    Returns:
+        rendered: {"fragments": {"{VideoList}": text, ..., "{VariantSettings}": text},
+                   "media": [(media type, media name, is_availability), ...],
+                   "applications": [(PreloadedApps/Menu/Home, appName, installMethod/BGColor/position), ...],
+                   "settings": [(settingId, packageId, value, settings file), ...]}  (--catalog only)
+    """
+    fragments = {}
+    resolved_media = []
+    resolved_applications = []
+
+    #update {VideoList} in the template
+    video_content_text = ""
+    video_content_list = config_set_inputs["Videos"]
+
+    for item in video_content_list:
+        is_availability = check_media_data(product_name, "Videos", item)
+        resolved_media.append(('Videos', item, is_availability))
+        if is_availability:
+            video_content_text += '                <Video Name="' + item + '" targetpath="" localpath="common/videos" />\n'
+
+    fragments["{VideoList}"] = video_content_text
+
+    #update {MusicList} in the template
+    music_content_text = ""
+    music_content_list = config_set_inputs["Music"]
+
+    for item in music_content_list:
+        is_availability = check_media_data(product_name, "Music", item)
+        resolved_media.append(('Music', item, is_availability))
+        if is_availability:
+            music_content_text += '                <Music Name="' + item + '" targetpath="" localpath="common/audio" />\n'
+    fragments["{MusicList}"] = music_content_text
+
+    #update {WallpaperList} in the template
+    wallpaper_content_text = ""
+    wallpaper_content_list = config_set_inputs["LockscreenWallpaper"]
+
+    for item in wallpaper_content_list:
+        is_availability = check_media_data(product_name, "LockscreenWallpaper", item)
+        resolved_media.append(('LockscreenWallpaper', item, is_availability))
+        if is_availability:
+            wallpaper_content_text += '                <Wallpaper Name="' + item + '" targetpath="" localpath="common/images" />\n'
+    fragments["{WallpaperList}"] = wallpaper_content_text
+
+    #update {RingtoneList} in the template
+    ringtones_content_text = ""
+    ringtones_content_list = config_set_inputs["RingingTones"]
+
+    for item in ringtones_content_list:
+        is_availability = check_media_data(product_name, "RingingTones", item)
+        resolved_media.append(('RingingTones', item, is_availability))
+        if is_availability:
+            ringtones_content_text += '                <Ringtone  Name="' + item + '" targetpath="" localpath="common/audio/ringtones" />\n'
+    fragments["{RingtoneList}"] = ringtones_content_text
+
+    #update {VariantPreloadApplicationsList} in the template
+    variantpreloadapp_content_text = ""
+    variantpreloadapp_content_list = config_set_inputs["PreloadedApps"]
+    for item in variantpreloadapp_content_list:
+        if item in VARIANT_APPLICATIONS_APPNAME_SET:
+            resolved_applications.append(("PreloadedApps", item, "preset"))
+            variantpreloadapp_content_text += '            <VariantApplication appName="' + item + '" installMethod="preset" />\n'
+        else:
+            print("Error: {VariantPreloadApplicationsList} %s not in the generated application list, please check!!" % item)
+            sys.exit()
+    fragments["{VariantPreloadApplicationsList}"] = variantpreloadapp_content_text
+
+    #update {VariantMenuApplicationsList} in the template
+    variantmenuapplication_content_text = ""
+    variantmenuapplication_content_list = config_set_inputs["Menu"]
+    for item in variantmenuapplication_content_list:
+        m=re.match("(.*)\((.*)\)", item)
+        #color given
+        if m:
+            item_name = m.group(1)
+            item_color = m.group(2)
+            if item_name in VARIANT_APPLICATIONS_APPNAME_SET:
+                resolved_applications.append(("Menu", item_name, item_color))
+                variantmenuapplication_content_text += '            <VariantApplication appName="' + item_name + '" BGColor="' + item_color + '" />\n'
+            else:
+                print("Error: {VariantMenuApplicationsList} %s not in the generated application list, please check!!" % item)
+                sys.exit()
+        #no color given
+        else:
+            item_name = m.group(1)
+            if item_name in VARIANT_APPLICATIONS_APPNAME_SET:
+                item_color = VARIANT_APPLICATIONS_APPNAME_BGCOLOR[item_name]
+                resolved_applications.append(("Menu", item_name, item_color))
+                variantmenuapplication_content_text += '            <VariantApplication appName="' + item_name + '" BGColor="' + item_color + '" />\n'
+            else:
+                print("Error: {VariantMenuApplicationsList} %s not in the generated application list, please check!!" % item)
+                sys.exit()
+    fragments["{VariantMenuApplicationsList}"] = variantmenuapplication_content_text
+
+    #update {VariantHomeScreenList} in the template
+    varianthomescreen_content_text = ""
+    varianthomescreen_content_list = config_set_inputs["Home"]
+    for item in varianthomescreen_content_list:
+        m=re.match("(.*)\((.*)\)", item)
+        item_name = m.group(1)
+        item_position = m.group(2).split(",")
+
+        item_collection = item_position[0]
+        item_row = item_position[1]
+        item_column = item_position[2]
+        item_width = item_position[3]
+        item_height = item_position[4]
+
+        if item_name in VARIANT_APPLICATIONS_APPNAME_SET:
+            resolved_applications.append(("Home", item_name, ",".join(item_position)))
+            varianthomescreen_content_text += '            <VariantApplication appName="' + item_name + '" Collection="' + item_collection + '" Row="' + item_row + '" Column="' + item_column + '" Width="' + item_width + '" Height="' + item_height + '" />\n'
+        else:
+            print("Error: {VariantHomeScreenList} %s not in the generated application list, please check!!" % item)
+            sys.exit()
+    fragments["{VariantHomeScreenList}"] = varianthomescreen_content_text
+
+    #update {VariantSettings} in the template
+    variantsettings_content = read_variant_settings_files(config_set_inputs["Settings"])
+    fragments["{VariantSettings}"] = "\n".join(setting[0] for setting in variantsettings_content.values())
+
+    rendered = {
+        "fragments": fragments,
+        "media": resolved_media,
+        "applications": resolved_applications,
+    }
+    if CATALOG: # only the catalog needs the settings one by one
+        rendered["settings"] = []
+        for setting_id, (line, setting_file) in variantsettings_content.items():
+            package_id, line_setting_id, value = read_setting_line(line)
+            rendered["settings"].append((setting_id, package_id, value, setting_file))
+
+    return rendered
+
+def get_rendered_config_set(fingerprint):
+    """
+    Return:
+        render_config_set_fragments() result of the fingerprint, None if not in RENDER_CACHE
+    """
+    with RENDER_CACHE_LOCK:
+        if fingerprint not in RENDER_CACHE:
+            return None
+        RENDER_CACHE.move_to_end(fingerprint)
+        return RENDER_CACHE[fingerprint][0]
+
+def cache_rendered_config_set(fingerprint, rendered):
+    """
+    Keep a rendered body into RENDER_CACHE, dropping the least recently used ones above RENDER_CACHE_MAX_SIZE,
+    so sub regions which all differ never keep more than that in memory.
+
+    Args:
+        fingerprint: config_set_fingerprint() of the inputs
+        rendered: render_config_set_fragments() result
+    Return:
+        rendered, or the identical body a concurrent render of the same inputs cached first
+    """
+    global RENDER_CACHE_SIZE
+
+    size = sum(len(text) for text in rendered["fragments"].values())
+    size += sum(len(setting_id) + len(package_id) + len(value) for setting_id, package_id, value, setting_file in rendered.get("settings", ()))
+    if size > RENDER_CACHE_MAX_SIZE:
+        return rendered
+
+    with RENDER_CACHE_LOCK:
+        if fingerprint in RENDER_CACHE:
+            return RENDER_CACHE[fingerprint][0]
+        RENDER_CACHE[fingerprint] = (rendered, size)
+        RENDER_CACHE_SIZE += size
+        while RENDER_CACHE_SIZE > RENDER_CACHE_MAX_SIZE:
+            dropped_fingerprint, (dropped, dropped_size) = RENDER_CACHE.popitem(last=False)
+            RENDER_CACHE_SIZE -= dropped_size
+            count_run_stat("config-sets dropped from cache")
+    return rendered
+
+def render_config_set_file(type_designator, product_name, product_nick_name, each_sv_sub_region, content_configure_data_info):
+    """
+    generate one {SubRegion}-config-data.xml file in config-sets folder
+
+    The body is rendered once per distinct resolved inputs (config_set_fingerprint), the other sub regions
+    resolving to the same media, applications and settings reuse it from RENDER_CACHE (bounded, see
+    cache_rendered_config_set) and only fill their own header.
 
     Args:
         type_designator:
+        product_name:
+        product_nick_name:
+        each_sv_sub_region: SV>EURO_RU (example)
+        content_configure_data_info: return value of get_content_configure_data_info
     Returns:
-        None
+        resolved: what the sub region resolved to, for --catalog and --footprint, None without them
+            {"sub_region": EURO_RU,
+             "media": [(media type, media name, is_availability), ...],
+             "applications": [(PreloadedApps/Menu/Home, appName, installMethod/BGColor/position), ...],
+             "settings": [(settingId, packageId, value, settings file), ...]}  (--catalog only)
     """
 
     config_data_template = os.path.join(TEMPLATE_PATH, "{SubRegion}-config-data.xml")
 
-    product_name, product_nick_name, codelist, content_configure_data = find_codelist_and_content_configure_data_files(type_designator)
+    each_sub_region = each_sv_sub_region.split(">")[1]     #Strip the "SV>" from "SV>EURO_RU"
+    each_sub_region_file_name = each_sub_region + '-config-data.xml'
+    each_sub_region_file_path = os.path.join(product_name, 'config-sets', each_sub_region_file_name)
 
-    product_output = os.path.join(OUTPUT, product_name)
+    config_set_inputs = resolve_config_set_inputs(product_name, product_nick_name, each_sv_sub_region, content_configure_data_info)
+    fingerprint = config_set_fingerprint(product_name, config_set_inputs)
 
-    sv_sub_region_list, videos_content, music_content, menu_content, home_content, preloadedapps_content, lockscreenwallpaper_content, ringingtones_content = get_content_configure_data_info(content_configure_data)
+    rendered = get_rendered_config_set(fingerprint)
+    if rendered is None:
+        rendered = render_config_set_fragments(product_name, config_set_inputs)
+        rendered = cache_rendered_config_set(fingerprint, rendered)
+    else:
+        LOGGER.debug("[render_config_set_file]:%s reuses the body rendered for fingerprint %s", each_sub_region, fingerprint)
+        count_run_stat("config-sets rendered from cache")
 
-    if not os.path.exists(os.path.join(product_output, 'config-sets')):
-        os.makedirs(os.path.join(product_output, 'config-sets'))
+    #start from the {SubRegion}-config-data.xml template
+    config_data_text = read_template_content(config_data_template)
 
-    for each_sv_sub_region in sv_sub_region_list:
-        each_sub_region = each_sv_sub_region.split(">")[1]     #Strip the "SV>" from "SV>EURO_RU"
-        each_sub_region_file_name = each_sub_region + '-config-data.xml'
-        each_sub_region_file_path = os.path.join(product_output, 'config-sets', each_sub_region_file_name)
+    #update {configuration_name} {config_id} {config_type} {config_name} {config_index} in the template
+    configuration_name = each_sub_region.replace("_"," ") + ' Configuration'
+    config_id = each_sub_region
+    config_type = "Area Configuration"
+    config_name = configuration_name
+    config_index = "C-0002"
 
-        #copy {SubRegion}-config-data.xml template to target folder.
-        shutil.copyfile(config_data_template, each_sub_region_file_path)
+    config_data_text = fill_template_content(config_data_text, {"{configuration_name}":configuration_name})
+    config_data_text = fill_template_content(config_data_text, {"{config_id}":config_id})
+    config_data_text = fill_template_content(config_data_text, {"{config_type}":config_type})
+    config_data_text = fill_template_content(config_data_text, {"{config_name}":config_name})
+    config_data_text = fill_template_content(config_data_text, {"{config_index}":config_index})
 
-        #update {configuration_name} {config_id} {config_type} {config_name} {config_index} in the template
-        configuration_name = each_sub_region.replace("_"," ") + ' Configuration'
-        config_id = each_sub_region
-        config_type = "Area Configuration"
-        config_name = configuration_name
-        config_index = "C-0002"
+    #update the body blocks, {VideoList} ... {VariantSettings}, in the template
+    config_data_text = fill_template_content(config_data_text, rendered["fragments"])
 
-        update_template_content(each_sub_region_file_path,{"{configuration_name}":configuration_name})
-        update_template_content(each_sub_region_file_path,{"{config_id}":config_id})
-        update_template_content(each_sub_region_file_path,{"{config_type}":config_type})
-        update_template_content(each_sub_region_file_path,{"{config_name}":config_name})
-        update_template_content(each_sub_region_file_path,{"{config_index}":config_index})
+    write_output_file(each_sub_region_file_path, config_data_text)
 
-        #update {VideoList} in the template
-        video_content_text = ""
-        if videos_content:
-            video_content_list = videos_content['PRODUCT'].split("/")
-            for item in videos_content.keys():
-                if item == "PRODUCT":
-                    continue
-                if item.split(">")[0] == "MV" and each_sub_region.split("_")[0] in item:
-                    video_content_list += videos_content[item].split("/")
-                if item.split(">")[1] == each_sub_region:
-                    video_content_list += videos_content[item].split("/")
-
-            for item in video_content_list:
-                if check_media_data(product_name, "Videos", item):
-                    video_content_text += '                <Video Name="' + item + '" targetpath="" localpath="common/videos" />\n'
-
-        update_template_content(each_sub_region_file_path,{"{VideoList}":video_content_text})
-
-        #update {MusicList} in the template
-        music_content_text = ""
-        if music_content:
-            music_content_list = music_content['PRODUCT'].split("/")
-            for item in music_content.keys():
-                if item == "PRODUCT":
-                    continue
-                if item.split(">")[0] == "MV" and each_sub_region.split("_")[0] in item:
-                    music_content_list += music_content[item].split("/")
-                if item.split(">")[1] == each_sub_region:
-                    music_content_list += music_content[item].split("/")
-
-            for item in music_content_list:
-                if check_media_data(product_name, "Music", item):
-                    music_content_text += '                <Music Name="' + item + '" targetpath="" localpath="common/audio" />\n'
-        update_template_content(each_sub_region_file_path,{"{MusicList}":music_content_text})
-
-        #update {WallpaperList} in the template
-        wallpaper_content_text = ""
-        if lockscreenwallpaper_content:
-            wallpaper_content_list = lockscreenwallpaper_content['PRODUCT'].split("/")
-            for item in lockscreenwallpaper_content.keys():
-                if item == "PRODUCT":
-                    continue
-                if each_sub_region.split("_")[0] in item:
-                    wallpaper_content_list += lockscreenwallpaper_content[item].split("/")
-                if item.split(">")[1] == each_sub_region:
-                    wallpaper_content_list += lockscreenwallpaper_content[item].split("/")
-
-            for item in wallpaper_content_list:
-                if check_media_data(product_name, "LockscreenWallpaper", item):
-                    wallpaper_content_text += '                <Wallpaper Name="' + item + '" targetpath="" localpath="common/images" />\n'
-        update_template_content(each_sub_region_file_path,{"{WallpaperList}":wallpaper_content_text})
-
-
-        #update {RingtoneList} in the template
-        ringtones_content_text = ""
-        if ringingtones_content:
-            ringtones_content_list = ringingtones_content['PRODUCT'].split("/")
-            for item in ringingtones_content.keys():
-                if item == "PRODUCT":
-                    continue
-                if each_sub_region.split("_")[0] in item:
-                    ringtones_content_list += ringingtones_content[item].split("/")
-                if item.split(">")[1] == each_sub_region:
-                    ringtones_content_list += ringingtones_content[item].split("/")
-
-            for item in ringtones_content_list:
-                if check_media_data(product_name, "RingingTones", item):
-                    ringtones_content_text += '                <Ringtone  Name="' + item + '" targetpath="" localpath="common/audio/ringtones" />\n'
-        update_template_content(each_sub_region_file_path,{"{RingtoneList}":ringtones_content_text})
-
-        #update {VariantPreloadApplicationsList} in the template
-        variantpreloadapp_content_text = ""
-        if preloadedapps_content:
-            variantpreloadapp_content_list = preloadedapps_content[each_sv_sub_region].split("/")
-            for item in variantpreloadapp_content_list:
-                if item in VARIANT_APPLICATIONS_APPNAME:
-                    variantpreloadapp_content_text += '            <VariantApplication appName="' + item + '" installMethod="preset" />\n'
-                else:
-                    print("Error: {VariantPreloadApplicationsList} %s not in the generated application list, please check!!" % item)
-                    sys.exit()
-        update_template_content(each_sub_region_file_path,{"{VariantPreloadApplicationsList}":variantpreloadapp_content_text})
-
-        #update {VariantMenuApplicationsList} in the template
-        variantmenuapplication_content_text = ""
-        if menu_content:
-            variantmenuapplication_content_list = menu_content[each_sv_sub_region].split("/")
-            for item in variantmenuapplication_content_list:
-                m=re.match("(.*)\((.*)\)", item)
-                #color given
-                if m:
-                    item_name = m.group(1)
-                    item_color = m.group(2)
-                    if item_name in VARIANT_APPLICATIONS_APPNAME:
-                        variantmenuapplication_content_text += '            <VariantApplication appName="' + item_name + '" BGColor="' + item_color + '" />\n'
-                    else:
-                        print("Error: {VariantMenuApplicationsList} %s not in the generated application list, please check!!" % item)
-                        sys.exit()
-                #no color given
-                else:
-                    item_name = m.group(1)
-                    if item_name in VARIANT_APPLICATIONS_APPNAME:
-                        item_color = VARIANT_APPLICATIONS_APPNAME_BGCOLOR[item_name]
-                        variantmenuapplication_content_text += '            <VariantApplication appName="' + item_name + '" BGColor="' + item_color + '" />\n'
-                    else:
-                        print("Error: {VariantMenuApplicationsList} %s not in the generated application list, please check!!" % item)
-                        sys.exit()
-        update_template_content(each_sub_region_file_path,{"{VariantMenuApplicationsList}":variantmenuapplication_content_text})
-
-        #update {VariantHomeScreenList} in the template
-        varianthomescreen_content_text = ""
-        if home_content:
-            varianthomescreen_content_list = home_content[each_sv_sub_region].split("/")
-            for item in varianthomescreen_content_list:
-                m=re.match("(.*)\((.*)\)", item)
-                item_name = m.group(1)
-                item_position = m.group(2).split(",")
-
-                item_collection = item_position[0]
-                item_row = item_position[1]
-                item_column = item_position[2]
-                item_width = item_position[3]
-                item_height = item_position[4]
-
-                if item_name in VARIANT_APPLICATIONS_APPNAME:
-                    varianthomescreen_content_text += '            <VariantApplication appName="' + item_name + '" Collection="' + item_collection + '" Row="' + item_row + '" Column="' + item_column + '" Width="' + item_width + '" Height="' + item_height + '" />\n'
-                else:
-                    print("Error: {VariantHomeScreenList} %s not in the generated application list, please check!!" % item)
-                    sys.exit()
-        update_template_content(each_sub_region_file_path,{"{VariantHomeScreenList}":varianthomescreen_content_text})
+    count_run_stat("config-sets rendered")
+
+    if not (CATALOG or FOOTPRINT):
+        return None # nobody reads it, the settings of every sub region would stay in memory until the end of the run
 
-        #update {VariantSettings} in the template
-        variantsettings_content_text = ""
-        variantsettings_content_text = variant_settings_collect(type_designator, product_name, product_nick_name, each_sv_sub_region)
-        update_template_content(each_sub_region_file_path,{"{VariantSettings}":variantsettings_content_text})
+    resolved = {
+        "sub_region": each_sub_region,
+        "media": rendered["media"],
+        "applications": rendered["applications"],
+    }
+    if CATALOG:
+        resolved["settings"] = rendered["settings"]
+    return resolved
 
-    logging.info("[generate_config_sets_files]: config-sets files generated successfully!")
-    print("[generate_config_sets_files]: config-sets files generated successfully!")
+def generate_config_sets_files(type_designator):
+    """
+    generate {SubRegion}-config-data.xml file in config-sets folder
+
+    Args:
+        type_designator:
+    Returns:
+        None
+    """
+
+    product_name, product_nick_name, codelist, content_configure_data = find_codelist_and_content_configure_data_files(type_designator)
+
+    content_configure_data_info = get_content_configure_data_info(content_configure_data)
+
+    for each_sv_sub_region in content_configure_data_info[0]:
+        render_config_set_file(type_designator, product_name, product_nick_name, each_sv_sub_region, content_configure_data_info)
+
+    LOGGER.info("[generate_config_sets_files]: config-sets files generated successfully!")
+    console("[generate_config_sets_files]: config-sets files generated successfully!")
+
+def render_variant_file(type_designator, product_name, codelist, each_ctr_code, count, codelist_info):
+    """
+    generate one {ProductName}_{CTR}.xml file in variants folder
+
+    Args:
+        type_designator:
+        product_name:
+        codelist:
+        each_ctr_code: 059W0Q7 (example)
+        count: 1-based position of each_ctr_code in the code list, used as variant index
+        codelist_info: return value of get_codelist_info
+    Returns:
+        None
+    """
+    variants_template = os.path.join(TEMPLATE_PATH, "{ProductName}_{CTR}.xml")
+
+    ctr_code_list, variant_region, country_set, sd_card, variant_ctrcode_to_subregions, variant_subregion_to_ctrcode = codelist_info
+
+    variant_file_name = product_name + '_' + each_ctr_code + '.xml'
+    variant_file_path = os.path.join(product_name, 'variants', variant_file_name)
+    variant_text = read_template_content(variants_template)
+
+    #update {variant_package_name} {variant_ctr} {variant_name} {variant_index} {variant_version}
+    #       {platform} {type_designator} {country_set} {has_sdcard} in the template
+    variant_package_name = ""
+    variant_ctr = each_ctr_code
+    variant_name = ""
+    variant_index = '%04d'%count
+    variant_version = "001"
+    platform = "AOL"
+    has_sdcard = ""
+    if "rm" in type_designator:
+        type_designator_upper = type_designator.replace("rm", "RM-")
+    elif "mm" in type_designator:
+        type_designator_upper = type_designator.replace("mm", "MM-")
+
+    variant_name = " ".join(variant_region[each_ctr_code]) + " variant"
+
+    #strip ERA, PAR, TRI operator name from APAC ID region
+    if "ID" in variant_region[each_ctr_code]:
+        variant_name = " ".join(variant_region[each_ctr_code][:-1]) + " variant"
+
+    variant_package_name = variant_ctr + " " + type_designator_upper + " " + variant_name
+
+    if sd_card[each_ctr_code] == "NO_SD":
+        has_sdcard = "False"
+    elif sd_card[each_ctr_code] == "HAS_SD":
+        has_sdcard = "True"
+
+    variant_text = fill_template_content(variant_text, {"{variant_package_name}":variant_package_name})
+    variant_text = fill_template_content(variant_text, {"{variant_ctr}":variant_ctr})
+    variant_text = fill_template_content(variant_text, {"{variant_name}":variant_name})
+    variant_text = fill_template_content(variant_text, {"{variant_index}":variant_index})
+    variant_text = fill_template_content(variant_text, {"{variant_version}":variant_version})
+    variant_text = fill_template_content(variant_text, {"{platform}":platform})
+    variant_text = fill_template_content(variant_text, {"{product_name}":product_name})
+    variant_text = fill_template_content(variant_text, {"{type_designator}":type_designator_upper})
+    variant_text = fill_template_content(variant_text, {"{country_set}":country_set[each_ctr_code]})
+    variant_text = fill_template_content(variant_text, {"{has_sdcard}":has_sdcard})
+
+    #update {variant_config_sets_content} in the template
+    variant_config_sets_content = ""
+    variant_config_sets_content = variant_config_sets_collect(each_ctr_code, codelist, variant_ctrcode_to_subregions, variant_subregion_to_ctrcode)
+    variant_text = fill_template_content(variant_text, {"{variant_config_sets_content}":variant_config_sets_content})
+
+    write_output_file(variant_file_path, variant_text)
+
+    count_run_stat("variants rendered")
 
 def generate_variants_files(type_designator):
     """
@@ -814,76 +1616,793 @@ def generate_variants_files(type_designator):
     Returns:
         None
     """
-    variants_template = os.path.join(TEMPLATE_PATH, "{ProductName}_{CTR}.xml")
+    product_name, product_nick_name, codelist, content_configure_data = find_codelist_and_content_configure_data_files(type_designator)
+
+    codelist_info = get_codelist_info(codelist)
+
+    count = 0
+    for each_ctr_code in codelist_info[0]:
+        count+=1
+        render_variant_file(type_designator, product_name, codelist, each_ctr_code, count, codelist_info)
+
+    LOGGER.info("[generate_variants_files]: variants files generated successfully!")
+    console("[generate_variants_files]: variants files generated successfully!")
+
+class Task(object):
+    """
+    One node of the generation task graph: a parse task, a per-sub-region or a per-CTR render task.
+
+    Args:
+        name: unique task name, e.g. parse:codelist, config-set:EURO_RU, variant:059W0Q7
+        func: callable, invoked with the results of the deps tasks (in deps order)
+        deps: names of the tasks which must be finished before this one starts
+        spawn: optional callable, invoked with the result of func once the task is finished,
+               returns the list of new tasks to add into the graph (parse tasks use it to
+               fan out the render tasks, since those are only known after parsing)
+    """
+    def __init__(self, name, func, deps=(), spawn=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.spawn = spawn
+        self.result = None
+        self.start = None
+        self.end = None
+
+    def run(self, *args):
+        self.start = time.time()
+        try:
+            return self.func(*args)
+        finally:
+            self.end = time.time()
+
+    def duration(self):
+        return self.end - self.start
+
+def run_task_graph(tasks, jobs=1):
+    """
+    Run the task graph, every task is started as soon as all its deps are finished,
+    so independent tasks overlap on the worker threads. With one job the tasks run one by one,
+    the ready task first in name order.
+
+    Args:
+        tasks: list of Task
+        jobs: number of worker threads
+    Return:
+        finished_tasks: {task name: Task}, all finished tasks
+    """
+    task_names = set()
+    pending_tasks = {}
+    finished_tasks = {}
+    running_tasks = {}
+
+    def add_task(task):
+        if task.name in task_names:
+            print("Error: [run_task_graph] duplicated task name: %s" % task.name)
+            sys.exit()
+        task_names.add(task.name)
+        pending_tasks[task.name] = task
+
+    for task in tasks:
+        add_task(task)
 
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+    try:
+        while pending_tasks or running_tasks:
+            for name in sorted(pending_tasks):
+                if jobs <= 1 and running_tasks:
+                    # one task at a time, in name order: the files are generated in the same order on every run
+                    break
+                task = pending_tasks[name]
+                if all(dep in finished_tasks for dep in task.deps):
+                    args = [finished_tasks[dep].result for dep in task.deps]
+                    running_tasks[executor.submit(task.run, *args)] = pending_tasks.pop(name)
+
+            if not running_tasks:
+                print("Error: [run_task_graph] unresolved task dependencies: %s" % sorted(pending_tasks))
+                sys.exit()
+
+            finished, not_finished = wait(running_tasks, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running_tasks.pop(future)
+                task.result = future.result() # re-raise the task error (sys.exit() included) in the main thread
+                finished_tasks[task.name] = task
+                LOGGER.debug("[run_task_graph] %s finished in %.3fs", task.name, task.duration())
+                if task.spawn:
+                    for new_task in task.spawn(task.result):
+                        add_task(new_task)
+    except BaseException:
+        # a failed task (sys.exit() included) fails the run: the queued tasks never start, only the running ones finish
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+
+    return finished_tasks
+
+def task_graph_critical_path(finished_tasks):
+    """
+    Find the critical path of a finished task graph: the dependency chain with the longest total task duration.
+
+    Args:
+        finished_tasks: return value of run_task_graph
+    Return:
+        critical_path: [Task, ...] from the first to the last task of the chain
+    """
+    chain_cost = {}
+    chain_prev = {}
+
+    # a task always ends after all its deps, so they are already computed in end time order
+    for task in sorted(finished_tasks.values(), key=lambda t: t.end):
+        chain_prev[task.name] = None
+        chain_cost[task.name] = task.duration()
+        for dep in task.deps:
+            if chain_cost[dep] + task.duration() > chain_cost[task.name]:
+                chain_cost[task.name] = chain_cost[dep] + task.duration()
+                chain_prev[task.name] = dep
+
+    critical_path = []
+    name = max(chain_cost, key=chain_cost.get) if chain_cost else None
+    while name:
+        critical_path.insert(0, finished_tasks[name])
+        name = chain_prev[name]
+
+    return critical_path
+
+def build_generation_task_graph(type_designator):
+    """
+    Express one run as a task graph:
+
+    parse:applications            -> cached-config-base application list
+    parse:content_configure_data  -> config-set:{SubRegion} (also needs parse:applications)
+    parse:codelist                -> variant:{CTR}
+
+    variants only depend on the codelist and country table, so they are rendered while
+    the config-sets are still busy with the settings files. With --shard, both parse tasks
+    feed plan:shards instead, which partitions the config-sets and variants together and
+    spawns the render tasks of this shard only.
+
+    Args:
+        type_designator:
+    Return:
+        tasks: list of Task
+    """
     product_name, product_nick_name, codelist, content_configure_data = find_codelist_and_content_configure_data_files(type_designator)
 
-    product_output = os.path.join(OUTPUT,product_name)
+    def parse_content_configure_data():
+        return get_content_configure_data_info(content_configure_data)
+
+    def render_config_set(each_sv_sub_region, content_configure_data_info, applications):
+        # applications: nothing to pass, the application list lives in VARIANT_APPLICATIONS_APPNAME*
+        resolved = render_config_set_file(type_designator, product_name, product_nick_name, each_sv_sub_region, content_configure_data_info)
+        if CATALOG_WRITER is not None:
+            CATALOG_WRITER.add_config_set(resolved)
+        if FOOTPRINT:
+            return {"sub_region": resolved["sub_region"], "media": resolved["media"]} # kept until media_footprint_report()
+        return None
+
+    def spawn_config_set_tasks(content_configure_data_info):
+        sv_sub_region_list = content_configure_data_info[0]
+        if SHARD:
+            sv_sub_region_list = [each_sv_sub_region for each_sv_sub_region in sv_sub_region_list
+                                  if is_in_shard((product_name, "config-set", each_sv_sub_region.split(">")[1]))]
+        return [Task("config-set:" + each_sv_sub_region.split(">")[1],
+                     partial(render_config_set, each_sv_sub_region),
+                     deps=["parse:content_configure_data", "parse:applications"])
+                for each_sv_sub_region in sv_sub_region_list]
+
+    def parse_codelist():
+        return get_codelist_info(codelist)
+
+    def spawn_variant_tasks(codelist_info):
+        ctr_code_list = list(enumerate(codelist_info[0], 1))
+        if SHARD:
+            ctr_code_list = [(count, each_ctr_code) for count, each_ctr_code in ctr_code_list
+                             if is_in_shard((product_name, "variant", each_ctr_code))]
+        return [Task("variant:" + each_ctr_code,
+                     partial(render_variant_file, type_designator, product_name, codelist, each_ctr_code, count),
+                     deps=["parse:codelist"])
+                for count, each_ctr_code in ctr_code_list]
+
+    def plan_shards(content_configure_data_info, codelist_info):
+        # one plan over all the work items: partitioned apart, config-sets and variants would each be
+        # balanced but their sum not
+        work_items = {}
+        for each_sv_sub_region in content_configure_data_info[0]:
+            work_items[(product_name, "config-set", each_sv_sub_region.split(">")[1])] = \
+                estimate_config_set_cost(product_name, product_nick_name, each_sv_sub_region, content_configure_data_info)
+        for each_ctr_code in codelist_info[0]:
+            work_items[(product_name, "variant", each_ctr_code)] = estimate_variant_cost(each_ctr_code, codelist_info)
+        SHARD_PLAN.update(partition_work_items(work_items, SHARD[1]))
+        return content_configure_data_info, codelist_info
+
+    def spawn_shard_tasks(parsed_info):
+        content_configure_data_info, codelist_info = parsed_info
+        return spawn_config_set_tasks(content_configure_data_info) + spawn_variant_tasks(codelist_info)
+
+    if SHARD:
+        return [
+            Task("parse:applications", partial(get_generated_variant_applications_list_info, type_designator)),
+            Task("parse:content_configure_data", parse_content_configure_data),
+            Task("parse:codelist", parse_codelist),
+            Task("plan:shards", plan_shards, deps=["parse:content_configure_data", "parse:codelist"], spawn=spawn_shard_tasks),
+        ]
+    return [
+        Task("parse:applications", partial(get_generated_variant_applications_list_info, type_designator)),
+        Task("parse:content_configure_data", parse_content_configure_data, spawn=spawn_config_set_tasks),
+        Task("parse:codelist", parse_codelist, spawn=spawn_variant_tasks),
+    ]
+
+def parse_shard_option(value):
+    """
+    Args:
+        value: 2/4 (example), shard 2 of 4
+    Return:
+        (shard index, shard count)
+    """
+    m = re.match(r"^(\d+)/(\d+)$", value)
+    if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        print("error message: --shard needs <index>/<count>, 1 <= index <= count, got %s" % value)
+        sys.exit(2)
+    return int(m.group(1)), int(m.group(2))
+
+def estimate_config_set_cost(product_name, product_nick_name, each_sv_sub_region, content_configure_data_info):
+    """
+    Estimate the render cost of a sub region: its media and application list sizes, plus its
+    settings cascade (file sizes, about 100 bytes per setting line).
+
+    Return:
+        cost: relative cost, only compared with other work items costs
+    """
+    sv_sub_region_list, videos_content, music_content, menu_content, home_content, preloadedapps_content, lockscreenwallpaper_content, ringingtones_content = content_configure_data_info
+    each_sub_region = each_sv_sub_region.split(">")[1]
 
-    if not os.path.exists(os.path.join(product_output, 'variants')):
-        os.makedirs(os.path.join(product_output, 'variants'))
+    cost = 10
+    for media_content, is_mv_only in ((videos_content, True), (music_content, True), (lockscreenwallpaper_content, False), (ringingtones_content, False)):
+        if media_content:
+            cost += len(resolve_media_content_list(media_content, each_sub_region, is_mv_only))
+    for applications_content in (preloadedapps_content, menu_content, home_content):
+        if each_sv_sub_region in applications_content:
+            cost += len(applications_content[each_sv_sub_region].split("/"))
 
-    ctr_code_list, variant_region, country_set, sd_card, variant_ctrcode_to_subregions, variant_subregion_to_ctrcode = get_codelist_info(codelist)
+    settings_index = get_settings_index()
+    cost += sum(settings_index.file_size(setting_file) for setting_file in settings_index.cascade(product_name, product_nick_name, each_sv_sub_region)) // 100
 
-    count = 0
+    return cost
+
+def estimate_variant_cost(each_ctr_code, codelist_info):
+    """
+    Estimate the render cost of a CTR: one config-set and its mcc codes per sub region.
+
+    Return:
+        cost: relative cost, only compared with other work items costs
+    """
+    return 10 + 5 * len(codelist_info[4][each_ctr_code])
+
+def partition_work_items(work_items, shard_count):
+    """
+    Split work items into shard_count shards of balanced total cost, heaviest item first
+    into the lightest shard. Only depends on the items and costs, so every shard computes
+    the same partition without talking to the others.
+
+    Args:
+        work_items: {work item: cost}
+        shard_count:
+    Return:
+        partition: {work item: shard index (from 1)}
+    """
+    partition = {}
+    shards = [(0, shard_index) for shard_index in range(1, shard_count + 1)]
+    for cost, work_item in sorted(((-cost, work_item) for work_item, cost in work_items.items())):
+        shard_cost, shard_index = heapq.heappop(shards)
+        partition[work_item] = shard_index
+        heapq.heappush(shards, (shard_cost - cost, shard_index))
+    return partition
+
+def is_in_shard(work_item):
+    """
+    Tell if work_item belongs to this --shard, by the SHARD_PLAN of the run.
+    """
+    return SHARD_PLAN[work_item] == SHARD[0]
+
+def write_shard_manifest(product_name, output_writer):
+    """
+    Write {OUTPUT}/{product}/manifest-shard-{i}-of-{N}.json: the shard plan fingerprint,
+    the work items and the files (path, size, sha256) of this shard, for merge_shard_manifests.
+    With --archive, "archive" is the archive path relative to the manifest folder.
+
+    Return:
+        manifest_path
+    """
+    shard_index, shard_count = SHARD
+    plan = sorted([list(work_item), shard] for work_item, shard in SHARD_PLAN.items())
+
+    manifest = output_writer.manifest()
+    manifest.update({
+        "product": product_name,
+        "shard": shard_index,
+        "shard_count": shard_count,
+        "plan": hashlib.sha256(json.dumps(plan).encode("utf-8")).hexdigest(),
+        "work_item_count": len(plan),
+        "work_items": [work_item for work_item, shard in plan if shard == shard_index],
+    })
+
+    manifest_folder = os.path.join(OUTPUT, product_name)
+    manifest["archive"] = os.path.relpath(os.path.abspath(ARCHIVE), os.path.abspath(manifest_folder)) if ARCHIVE else ""
+    if not os.path.isdir(manifest_folder):
+        os.makedirs(manifest_folder)
+    manifest_path = os.path.join(manifest_folder, "manifest-shard-%d-of-%d.json" % (shard_index, shard_count))
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    LOGGER.info("[write_shard_manifest] shard %d/%d: %d work items, %d files", shard_index, shard_count, len(manifest["work_items"]), len(manifest["files"]))
+    return manifest_path
+
+def read_archive_digests(archive_path):
+    """
+    Read the members of an ArchiveOutput archive, one chunk at a time.
+
+    Return:
+        digests: {member name: (size, sha256)}
+    """
+    digests = {}
+    def add_member(name, f):
+        sha256 = hashlib.sha256()
+        size = 0
+        for chunk in iter(partial(f.read, 1 << 20), b""):
+            sha256.update(chunk)
+            size += len(chunk)
+        digests[name] = (size, sha256.hexdigest())
+
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                with archive.open(info) as f:
+                    add_member(info.filename, f)
+    else:
+        with tarfile.open(archive_path, "r|*") as archive:
+            for info in archive:
+                if info.isfile():
+                    add_member(info.name, archive.extractfile(info))
+    return digests
+
+def merge_shard_manifests(merged_manifest_path, manifest_paths):
+    """
+    Combine the shard manifests of one or more products and verify them:
+    every shard 1..N present once with the same plan, work items and files never
+    produced twice, all work items covered, and every file matching its size and
+    sha256, under OUTPUT or in the shard archive.
+
+    Args:
+        merged_manifest_path: the combined manifest
+        manifest_paths: manifest-shard-{i}-of-{N}.json files
+    Return:
+        None, exits with 1 on the first problem found
+    """
+    def fail(text):
+        print("Error: [merge_shard_manifests] %s" % text)
+        sys.exit(1)
+
+    manifests_by_product = {}
+    for manifest_path in manifest_paths:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        manifest["manifest_path"] = manifest_path # not merged, only to find the shard archive
+        manifests_by_product.setdefault(manifest["product"], []).append(manifest)
+
+    merged_files = {}
+    for product_name in sorted(manifests_by_product):
+        manifests = manifests_by_product[product_name]
+        shard_count = manifests[0]["shard_count"]
+        plan = manifests[0]["plan"]
+
+        shard_indexes = sorted(manifest["shard"] for manifest in manifests)
+        if shard_indexes != list(range(1, shard_count + 1)):
+            fail("%s: expected shards 1..%d once each, got %s" % (product_name, shard_count, shard_indexes))
+        if any(manifest["shard_count"] != shard_count or manifest["plan"] != plan for manifest in manifests):
+            fail("%s: shards come from different plans (different inputs or shard counts)" % product_name)
+
+        work_items = set()
+        for manifest in manifests:
+            for work_item in manifest["work_items"]:
+                if tuple(work_item) in work_items:
+                    fail("%s: work item %s done by several shards" % (product_name, work_item))
+                work_items.add(tuple(work_item))
+        if len(work_items) != manifests[0]["work_item_count"]:
+            fail("%s: %d work items done, %d planned" % (product_name, len(work_items), manifests[0]["work_item_count"]))
+
+        for manifest in manifests:
+            archive_digests = None
+            if manifest["archive"]:
+                archive_path = os.path.join(os.path.dirname(os.path.abspath(manifest["manifest_path"])), manifest["archive"])
+                if not os.path.isfile(archive_path):
+                    fail("%s is missing" % archive_path)
+                archive_digests = read_archive_digests(archive_path)
+            for entry in manifest["files"]:
+                if entry["path"] in merged_files:
+                    fail("%s generated by several shards" % entry["path"])
+                merged_files[entry["path"]] = entry
+                if archive_digests is not None:
+                    member_name = entry["path"].replace(os.sep, "/")
+                    if member_name not in archive_digests:
+                        fail("%s is missing from %s" % (member_name, archive_path))
+                    if archive_digests[member_name] != (entry["size"], entry["sha256"]):
+                        fail("%s in %s does not match its shard manifest" % (member_name, archive_path))
+                    continue
+                file_path = os.path.join(OUTPUT, entry["path"])
+                if not os.path.isfile(file_path):
+                    fail("%s is missing" % file_path)
+                with open(file_path, "rb") as f:
+                    data = f.read()
+                if len(data) != entry["size"] or hashlib.sha256(data).hexdigest() != entry["sha256"]:
+                    fail("%s does not match its shard manifest" % file_path)
+
+    merged_manifest = {"products": sorted(manifests_by_product), "files": [merged_files[path] for path in sorted(merged_files)]}
+    with open(merged_manifest_path, "w") as f:
+        json.dump(merged_manifest, f, indent=1, sort_keys=True)
+
+    LOGGER.info("[merge_shard_manifests] %d shard manifests, %d files into %s", len(manifest_paths), len(merged_files), merged_manifest_path)
+    console("[merge_shard_manifests]: %d shard manifests verified, %d files, merged into %s" % (len(manifest_paths), len(merged_files), merged_manifest_path))
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_name TEXT PRIMARY KEY,
+    product_nick_name TEXT NOT NULL,
+    type_designator TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS variants (
+    product_name TEXT NOT NULL,
+    ctr_code TEXT NOT NULL,
+    variant_index INTEGER NOT NULL,
+    variant_region TEXT NOT NULL,
+    country_set TEXT NOT NULL,
+    sd_card TEXT NOT NULL,
+    PRIMARY KEY (product_name, ctr_code)
+);
+CREATE TABLE IF NOT EXISTS variant_sub_regions (
+    product_name TEXT NOT NULL,
+    ctr_code TEXT NOT NULL,
+    sub_region TEXT NOT NULL,
+    sub_region_code TEXT NOT NULL,
+    is_default INTEGER NOT NULL,
+    PRIMARY KEY (product_name, ctr_code, sub_region)
+);
+CREATE TABLE IF NOT EXISTS sub_region_media (
+    product_name TEXT NOT NULL,
+    sub_region TEXT NOT NULL,
+    media_type TEXT NOT NULL,
+    media_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    is_available INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sub_region_applications (
+    product_name TEXT NOT NULL,
+    sub_region TEXT NOT NULL,
+    list_type TEXT NOT NULL,
+    app_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    attribute TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sub_region_settings (
+    product_name TEXT NOT NULL,
+    sub_region TEXT NOT NULL,
+    setting_id TEXT NOT NULL,
+    package_id TEXT NOT NULL,
+    value TEXT NOT NULL,
+    settings_file TEXT NOT NULL,
+    PRIMARY KEY (product_name, sub_region, setting_id)
+);
+CREATE INDEX IF NOT EXISTS variant_sub_regions_ctr_code ON variant_sub_regions (ctr_code);
+CREATE INDEX IF NOT EXISTS variant_sub_regions_sub_region ON variant_sub_regions (product_name, sub_region);
+CREATE INDEX IF NOT EXISTS sub_region_media_sub_region ON sub_region_media (product_name, sub_region);
+CREATE INDEX IF NOT EXISTS sub_region_media_media_name ON sub_region_media (media_name);
+CREATE INDEX IF NOT EXISTS sub_region_applications_sub_region ON sub_region_applications (product_name, sub_region);
+CREATE INDEX IF NOT EXISTS sub_region_applications_app_name ON sub_region_applications (app_name);
+CREATE INDEX IF NOT EXISTS sub_region_settings_sub_region ON sub_region_settings (product_name, sub_region);
+CREATE INDEX IF NOT EXISTS sub_region_settings_setting_id ON sub_region_settings (setting_id);
+"""
+
+class CatalogWriter(object):
+    """
+    Save what one product resolved into the SQLite catalog, replacing the previous rows of this product
+    only, so the catalog covers every product ever generated into it. Example queries:
+
+        which CTRs ship ringtone X:
+            SELECT DISTINCT v.product_name, v.ctr_code FROM sub_region_media m
+            JOIN variant_sub_regions v ON v.product_name = m.product_name AND v.sub_region = m.sub_region
+            WHERE m.media_type = 'RingingTones' AND m.media_name = 'X' AND m.is_available
+        which sub regions override settingId Y:
+            SELECT product_name, sub_region, value, settings_file FROM sub_region_settings
+            WHERE setting_id = 'Y' AND settings_file LIKE 'Settings_SV_%'
+
+    The rows of each sub region are inserted as soon as its config-set is rendered, so they are never
+    all kept in memory. Everything goes into one transaction committed by close(): readers never see a
+    half updated product, and a failed run leaves the previous rows of the product as they were.
+
+    Args:
+        catalog_path: SQLite database file, created if needed
+        type_designator:
+    """
+    def __init__(self, catalog_path, type_designator):
+        self.catalog_path = catalog_path
+        self.product_name, self.product_nick_name, codelist, content_configure_data = find_codelist_and_content_configure_data_files(type_designator)
+        self.lock = threading.Lock()
+        self.row_counts = collections.Counter()
+
+        self.connection = sqlite3.connect(catalog_path, check_same_thread=False) # config-set tasks add their rows from the worker threads
+        self.connection.executescript(CATALOG_SCHEMA)
+        for table in ("variants", "variant_sub_regions", "sub_region_media", "sub_region_applications", "sub_region_settings"):
+            self.connection.execute("DELETE FROM %s WHERE product_name = ?" % table, (self.product_name,))
+        self.connection.execute("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)",
+                                (self.product_name, self.product_nick_name, type_designator, time.strftime("%Y-%m-%d %H:%M:%S")))
+
+    def add_config_set(self, resolved):
+        """
+        Args:
+            resolved: return value of render_config_set_file
+        """
+        product_name = self.product_name
+        each_sub_region = resolved["sub_region"]
+        media_rows = [(product_name, each_sub_region, media_type, media_name, position, int(is_availability))
+                      for position, (media_type, media_name, is_availability) in enumerate(resolved["media"])]
+        applications_rows = [(product_name, each_sub_region, list_type, app_name, position, attribute)
+                             for position, (list_type, app_name, attribute) in enumerate(resolved["applications"])]
+        settings_rows = [(product_name, each_sub_region, setting_id, package_id, value, setting_file)
+                         for setting_id, package_id, value, setting_file in resolved["settings"]]
+
+        with self.lock:
+            self.connection.executemany("INSERT INTO sub_region_media VALUES (?, ?, ?, ?, ?, ?)", media_rows)
+            self.connection.executemany("INSERT INTO sub_region_applications VALUES (?, ?, ?, ?, ?, ?)", applications_rows)
+            self.connection.executemany("INSERT OR REPLACE INTO sub_region_settings VALUES (?, ?, ?, ?, ?, ?)", settings_rows)
+            self.row_counts["sub regions"] += 1
+            self.row_counts["media"] += len(media_rows)
+            self.row_counts["applications"] += len(applications_rows)
+            self.row_counts["settings"] += len(settings_rows)
+
+    def add_variants(self, codelist_info):
+        """
+        Args:
+            codelist_info: return value of get_codelist_info
+        """
+        ctr_code_list, variant_region, country_set, sd_card, variant_ctrcode_to_subregions, variant_subregion_to_ctrcode = codelist_info
+
+        variants_rows = []
+        variant_sub_regions_rows = []
+        for count, each_ctr_code in enumerate(ctr_code_list, 1):
+            variants_rows.append((self.product_name, each_ctr_code, count, " ".join(variant_region[each_ctr_code]), country_set[each_ctr_code], sd_card[each_ctr_code]))
+            for position, each_sub_region in enumerate(variant_ctrcode_to_subregions[each_ctr_code]):
+                variant_sub_regions_rows.append((self.product_name, each_ctr_code, each_sub_region, variant_subregion_to_ctrcode[each_sub_region], int(position == 0)))
+
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO variants VALUES (?, ?, ?, ?, ?, ?)", variants_rows)
+            self.connection.executemany("INSERT OR REPLACE INTO variant_sub_regions VALUES (?, ?, ?, ?, ?)", variant_sub_regions_rows)
+            self.row_counts["variants"] += len(variants_rows)
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+        LOGGER.info("[CatalogWriter] %s: %d variants, %d sub regions, %d media, %d applications, %d settings into %s",
+                    self.product_name, self.row_counts["variants"], self.row_counts["sub regions"], self.row_counts["media"],
+                    self.row_counts["applications"], self.row_counts["settings"], self.catalog_path)
+        console("[CatalogWriter]: %s catalog updated in %s" % (self.product_name, self.catalog_path))
+
+MEDIA_TYPE_FOLDERS = {"Videos": "videos", "Music": "audio", "RingingTones": "audio", "AlertTones": "audio", "MiscTones": "audio", "LockscreenWallpaper": "images"}
+
+def locate_media_file(product_name, media_type, media_item):
+    """
+    Find the storage file of a media item, the product folder first, then the common one.
+    Only looks into the get_storage_media_files() listings, no file system access.
+
+    Args:
+        product_name:
+        media_type: Videos, Music, RingingTones, LockscreenWallpaper ... (check_media_data types)
+        media_item: a.mp4 (example)
+    Return:
+        media_path, None if the file is in none of them
+    """
+    media_folder = MEDIA_TYPE_FOLDERS[media_type]
+    videos_file_list, audio_file_list, images_file_list = get_storage_media_files(product_name)
+    file_list = {"videos": videos_file_list, "audio": audio_file_list, "images": images_file_list}[media_folder]
+    if media_item not in file_list:
+        return None
+    if media_item in PRODUCT_STORAGE_MEDIA_FILES[(STORAGE_PATH, product_name)][media_folder]:
+        storage_folder = product_name
+    else:
+        storage_folder = "common"
+    return os.path.normpath(os.path.join(STORAGE_PATH, storage_folder, media_folder, media_item))
+
+def hash_media_file(media_path):
+    sha256 = hashlib.sha256()
+    with open(media_path, "rb") as f:
+        for chunk in iter(partial(f.read, 1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def load_media_stat_cache(cache_path):
+    """
+    Return:
+        media_stat_cache: {media path: {"size": bytes, "mtime": st_mtime_ns, "sha256": hex digest or missing}}
+    """
+    if not cache_path or not os.path.isfile(cache_path):
+        return {}
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except ValueError:
+        LOGGER.warning("[load_media_stat_cache] %s is corrupted, scanning from scratch", cache_path)
+        return {}
+
+def save_media_stat_cache(cache_path, media_stat_cache):
+    if not cache_path:
+        return
+    cache_folder = os.path.dirname(os.path.abspath(cache_path))
+    fd, temp_path = tempfile.mkstemp(prefix=".media_stat_cache-", dir=cache_folder)
+    with os.fdopen(fd, "w") as f:
+        json.dump(media_stat_cache, f, sort_keys=True)
+    os.replace(temp_path, cache_path)   # a killed run never leaves half a cache
+
+def scan_media_files(media_paths, is_hash, cache_path):
+    """
+    Stat (and sha256 if is_hash) the media files on JOBS threads. A file whose size and mtime
+    are the ones of the cache is not hashed again, so repeated runs only pay the stat calls.
+
+    Args:
+        media_paths: iterable of media file paths
+        is_hash: True, also compute the sha256 of every file
+        cache_path: MEDIA_STAT_CACHE
+    Return:
+        media_stats: {media path: {"size": bytes, "mtime": st_mtime_ns[, "sha256": hex digest]}}
+    """
+    media_stat_cache = load_media_stat_cache(cache_path)
+
+    def scan(media_path):
+        stat = os.stat(media_path)
+        cached = media_stat_cache.get(media_path)
+        if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime_ns and (not is_hash or "sha256" in cached):
+            count_run_stat("media stats from cache")
+            return cached
+        media_stat = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        if is_hash:
+            media_stat["sha256"] = hash_media_file(media_path)
+            count_run_stat("media files hashed")
+        count_run_stat("media files scanned")
+        return media_stat
+
+    media_paths = sorted(set(media_paths))
+    executor = ThreadPoolExecutor(max_workers=max(1, JOBS))
+    try:
+        media_stats = dict(zip(media_paths, executor.map(scan, media_paths)))
+    finally:
+        executor.shutdown(wait=True)
+
+    media_stat_cache.update(media_stats)    # keep the entries of the other products
+    save_media_stat_cache(cache_path, media_stat_cache)
+
+    return media_stats
+
+def media_footprint_report(report_path, type_designator, codelist_info, config_sets_resolved):
+    """
+    Total the media bytes each sub region and each CTR ships, from the media the config-sets resolved,
+    and write them as a JSON report. A CTR ships the files of all its sub regions, a file listed
+    by several of them (or twice in one cascade) is counted once.
+
+    Args:
+        report_path: JSON report file
+        type_designator:
+        codelist_info: return value of get_codelist_info
+        config_sets_resolved: return values of render_config_set_file
+    Return:
+        report: {"product": athena,
+                 "sub_regions": {EURO_RU: {"bytes": 1234, "files": 3, "media_types": {"Videos": 1000, ...}}, ...},
+                 "variants": {059W0Q7: {"bytes": 2345, "files": 5, "sub_regions": [EURO_RU, ...]}, ...},
+                 "files": [{"path": common/videos/a.mp4, "size": 1000[, "sha256": ...]}, ...]} (example)
+    """
+    product_name, product_nick_name, codelist, content_configure_data = find_codelist_and_content_configure_data_files(type_designator)
+    ctr_code_list, variant_region, country_set, sd_card, variant_ctrcode_to_subregions, variant_subregion_to_ctrcode = codelist_info
+
+    media_locations = {}            # {(media type, media name): media path}, every media is located once
+    for resolved in config_sets_resolved:
+        for media_type, media_name, is_availability in resolved["media"]:
+            if is_availability and (media_type, media_name) not in media_locations:
+                media_locations[(media_type, media_name)] = locate_media_file(product_name, media_type, media_name)
+
+    sub_region_media_paths = {}     # {sub region: {media path: media type}}
+    for resolved in config_sets_resolved:
+        media_paths = sub_region_media_paths.setdefault(resolved["sub_region"], {})
+        for media_type, media_name, is_availability in resolved["media"]:
+            media_path = media_locations.get((media_type, media_name)) if is_availability else None
+            if media_path:
+                media_paths.setdefault(media_path, media_type)
+
+    media_stats = scan_media_files((media_path for media_paths in sub_region_media_paths.values() for media_path in media_paths),
+                                   FOOTPRINT_HASH, MEDIA_STAT_CACHE)
+
+    sub_regions = {}
+    for each_sub_region in sorted(sub_region_media_paths):
+        media_types = collections.Counter()
+        for media_path, media_type in sub_region_media_paths[each_sub_region].items():
+            media_types[media_type] += media_stats[media_path]["size"]
+        sub_regions[each_sub_region] = {"bytes": sum(media_types.values()), "files": len(sub_region_media_paths[each_sub_region]), "media_types": dict(media_types)}
+
+    variants = {}
     for each_ctr_code in ctr_code_list:
-        count+=1
-        variant_file_name = product_name + '_' + each_ctr_code + '.xml'
-        variant_file_path = os.path.join(product_output, 'variants', variant_file_name)
-        shutil.copyfile(variants_template, variant_file_path)
-
-        #update {variant_package_name} {variant_ctr} {variant_name} {variant_index} {variant_version}
-        #       {platform} {type_designator} {country_set} {has_sdcard} in the template
-        variant_package_name = ""
-        variant_ctr = each_ctr_code
-        variant_name = ""
-        variant_index = '%04d'%count
-        variant_version = "001"
-        platform = "AOL"
-        has_sdcard = ""
-        if "rm" in type_designator:
-            type_designator_upper = type_designator.replace("rm", "RM-")
-        elif "mm" in type_designator:
-            type_designator_upper = type_designator.replace("mm", "MM-")
-
-        variant_name = " ".join(variant_region[each_ctr_code]) + " variant"
-
-        #strip ERA, PAR, TRI operator name from APAC ID region
-        if "ID" in variant_region[each_ctr_code]:
-            variant_name = " ".join(variant_region[each_ctr_code][:-1]) + " variant"
-
-        variant_package_name = variant_ctr + " " + type_designator_upper + " " + variant_name
-
-        if sd_card[each_ctr_code] == "NO_SD":
-            has_sdcard = "False"
-        elif sd_card[each_ctr_code] == "HAS_SD":
-            has_sdcard = "True"
-
-        update_template_content(variant_file_path,{"{variant_package_name}":variant_package_name})
-        update_template_content(variant_file_path,{"{variant_ctr}":variant_ctr})
-        update_template_content(variant_file_path,{"{variant_name}":variant_name})
-        update_template_content(variant_file_path,{"{variant_index}":variant_index})
-        update_template_content(variant_file_path,{"{variant_version}":variant_version})
-        update_template_content(variant_file_path,{"{platform}":platform})
-        update_template_content(variant_file_path,{"{product_name}":product_name})
-        update_template_content(variant_file_path,{"{type_designator}":type_designator_upper})
-        update_template_content(variant_file_path,{"{country_set}":country_set[each_ctr_code]})
-        update_template_content(variant_file_path,{"{has_sdcard}":has_sdcard})
-
-        #update {variant_config_sets_content} in the template
-        variant_config_sets_content = ""
-        variant_config_sets_content = variant_config_sets_collect(each_ctr_code, codelist, variant_ctrcode_to_subregions, variant_subregion_to_ctrcode)
-        update_template_content(variant_file_path,{"{variant_config_sets_content}":variant_config_sets_content})
-
-    logging.info("[generate_variants_files]: variants files generated successfully!")
-    print("[generate_variants_files]: variants files generated successfully!")
+        ctr_sub_regions = [each_sub_region for each_sub_region in variant_ctrcode_to_subregions[each_ctr_code] if each_sub_region in sub_region_media_paths]
+        ctr_media_paths = set()
+        for each_sub_region in ctr_sub_regions:
+            ctr_media_paths.update(sub_region_media_paths[each_sub_region])
+        variants[each_ctr_code] = {"bytes": sum(media_stats[media_path]["size"] for media_path in ctr_media_paths), "files": len(ctr_media_paths), "sub_regions": ctr_sub_regions}
+
+    files = []
+    for media_path in sorted(media_stats):
+        entry = {"path": os.path.relpath(media_path, STORAGE_PATH).replace(os.sep, "/"), "size": media_stats[media_path]["size"]}
+        if FOOTPRINT_HASH:
+            entry["sha256"] = media_stats[media_path]["sha256"]
+        files.append(entry)
+
+    report = {"product": product_name, "sub_regions": sub_regions, "variants": variants, "files": files}
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+    LOGGER.info("[media_footprint_report] %s: %d media files, %d sub regions, %d variants into %s", product_name, len(files), len(sub_regions), len(variants), report_path)
+    if variants:
+        largest_ctr_code = max(sorted(variants), key=lambda each_ctr_code: variants[each_ctr_code]["bytes"])
+        console("[media_footprint_report]: %s largest variant %s ships %d media bytes, report in %s" % (product_name, largest_ctr_code, variants[largest_ctr_code]["bytes"], report_path))
+
+    return report
+
+def reset_run_state():
+    """
+    Forget everything loaded or cached by a previous run, so that one process can run several times.
+    """
+    global VARIANT_APPLICATIONS_APPNAME
+    global VARIANT_APPLICATIONS_APPNAME_BGCOLOR
+    global VARIANT_APPLICATIONS_APPNAME_SET
+    global OUTPUT_WRITER
+    global RENDER_CACHE_SIZE
+
+    VARIANT_APPLICATIONS_APPNAME = []
+    VARIANT_APPLICATIONS_APPNAME_BGCOLOR = {}
+    VARIANT_APPLICATIONS_APPNAME_SET = set()
+    OUTPUT_WRITER = None
+    SHARD_PLAN.clear()
+    TEMPLATE_CONTENT.clear()
+    COUNTRY_MCC_INFO.clear()
+    STORAGE_MEDIA_FILES.clear()
+    PRODUCT_STORAGE_MEDIA_FILES.clear()
+    with SETTINGS_INDEX_LOCK:
+        SETTINGS_INDEX.clear()
+    with RENDER_CACHE_LOCK:
+        RENDER_CACHE.clear()
+        RENDER_CACHE_SIZE = 0
+    with RUN_STATS_LOCK:
+        RUN_STATS.clear()
+        MISSING_MEDIA.clear()
 
 def main():
 
     global OUTPUT
+    global CATALOG_WRITER
+    global JOBS
+    global ARCHIVE
+    global CATALOG
+    global SHARD
+    global IO_THREADS
+    global IO_QUEUE_SIZE
+    global FSYNC
+    global FOOTPRINT
+    global FOOTPRINT_HASH
+    global MEDIA_STAT_CACHE
+    global MMAP_MIN_SIZE
+
+    log_level = None
+    log_file = None
+    quiet = None
+    merged_manifest_path = ""
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "ho:t:")
+        opts, args = getopt.getopt(sys.argv[1:], "ho:t:j:qa:", ["log-level=", "log-file=", "quiet", "archive=", "catalog=", "shard=", "merge-manifests=", "io-threads=", "io-queue=", "fsync=", "footprint=", "footprint-hash", "media-cache=", "mmap-min-size="])
     except getopt.GetoptError as err:
         # print help information and exit:
         print("error message:", err)
@@ -892,25 +2411,103 @@ def main():
     for opt, value in opts:
         if opt == "-o":
             OUTPUT = value
-            print("main OUTPUT",value)
         elif opt == "-t":
             type_designator = value
+        elif opt == "-j":
+            JOBS = int(value)
+        elif opt in ("-a", "--archive"):
+            ARCHIVE = value
+        elif opt in ("-q", "--quiet"):
+            quiet = True
+        elif opt == "--log-level":
+            log_level = logging.getLevelName(value.upper())
+            if not isinstance(log_level, int):
+                print("error message: unknown log level %s" % value)
+                sys.exit(2)
+        elif opt == "--log-file":
+            log_file = value
+        elif opt == "--catalog":
+            CATALOG = value
+        elif opt == "--shard":
+            SHARD = parse_shard_option(value)
+        elif opt == "--merge-manifests":
+            merged_manifest_path = value
+        elif opt == "--io-threads":
+            IO_THREADS = int(value)
+        elif opt == "--io-queue":
+            IO_QUEUE_SIZE = int(value)
+        elif opt == "--fsync":
+            if value not in ("none", "file", "end"):
+                print("error message: --fsync needs none, file or end, got %s" % value)
+                sys.exit(2)
+            FSYNC = value
+        elif opt == "--footprint":
+            FOOTPRINT = value
+        elif opt == "--footprint-hash":
+            FOOTPRINT_HASH = True
+        elif opt == "--media-cache":
+            MEDIA_STAT_CACHE = value
+        elif opt == "--mmap-min-size":
+            MMAP_MIN_SIZE = int(value)
         elif opt == "-h":
-            print('abc.py -t <rm1057> -o <out dir>')
+            print('abc.py -t <rm1057> -o <out dir> -j <jobs> [-a <out.zip|out.tar[.gz|.bz2|.xz]>] [--catalog=<catalog.db>] [--io-threads=<2>] [--io-queue=<64>] [--fsync=<none|file|end>] [--footprint=<footprint.json> [--footprint-hash] [--media-cache=<media_stat_cache.json|>]] [--mmap-min-size=<bytes>] [-q] [--log-level=<DEBUG|INFO|WARNING|ERROR>] [--log-file=<newabc.log|-|>]')
+            print('abc.py -t <rm1057> -o <out dir> --shard=<index>/<count> ...')
+            print('abc.py -o <out dir> --merge-manifests=<merged manifest> <shard manifest> ...')
             sys.exit()
         else:
             assert False, "unhandled option"
 
-    # get variant application list info : appName, BGColor etc.. in generated xml, and save them into global variable for using.
-    get_generated_variant_applications_list_info(type_designator)
+    setup_logging(log_level, log_file, quiet)
 
-    # generate config_data.xml file in config-sets folder
-    generate_config_sets_files(type_designator)
+    if merged_manifest_path:
+        merge_shard_manifests(merged_manifest_path, args)
+        sys.exit()
 
-    # generate ctr.xml file in variants folder
-    generate_variants_files(type_designator)
+    if SHARD and CATALOG:
+        print("error message: --catalog needs all the work items, it can't be used with --shard")
+        sys.exit(2)
+    if SHARD and FOOTPRINT:
+        print("error message: --footprint needs all the work items, it can't be used with --shard")
+        sys.exit(2)
 
-    print("[main]: all files generated successfully!")
+    LOGGER.info("TOOL_PATH: %s", TOOL_PATH)
+    LOGGER.info("TEMPLATE_PATH: %s", TEMPLATE_PATH)
+    LOGGER.info("OUTPUT: %s", OUTPUT)
+    if "-o" in [opt for opt, value in opts]:
+        console("main OUTPUT %s" % OUTPUT)
+
+    # application list loading, config_data.xml files in config-sets folder and ctr.xml files in variants folder,
+    # run as a task graph so that the independent parts overlap.
+    start = time.time()
+    output_writer = open_output_writer()
+    try:
+        if CATALOG:
+            CATALOG_WRITER = CatalogWriter(CATALOG, type_designator)
+        finished_tasks = run_task_graph(build_generation_task_graph(type_designator), JOBS)
+        output_writer.close()
+    except BaseException:
+        # sys.exit() included: no half written archive left behind, no writer thread left running
+        output_writer.abort()
+        raise
+    if SHARD:
+        write_shard_manifest(find_codelist_and_content_configure_data_files(type_designator)[0], output_writer)
+    if CATALOG_WRITER is not None:
+        CATALOG_WRITER.add_variants(finished_tasks["parse:codelist"].result)
+        CATALOG_WRITER.close()
+        CATALOG_WRITER = None
+    if FOOTPRINT:
+        media_footprint_report(FOOTPRINT, type_designator, finished_tasks["parse:codelist"].result,
+                               [finished_tasks[name].result for name in sorted(finished_tasks) if name.startswith("config-set:")])
+    elapsed = time.time() - start
+
+    critical_path = task_graph_critical_path(finished_tasks)
+    critical_path_text = " -> ".join("%s(%.3fs)" % (task.name, task.duration()) for task in critical_path)
+    LOGGER.info("[main] %d tasks in %.3fs, critical path %.3fs: %s", len(finished_tasks), elapsed, sum(task.duration() for task in critical_path), critical_path_text)
+    console("[main]: %d tasks in %.3fs, critical path: %s" % (len(finished_tasks), elapsed, critical_path_text))
+
+    log_run_summary()
+
+    console("[main]: all files generated successfully!")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,89 @@
+"""
+Catalog tests: run newabc.py --catalog on the scaling fixture (see test_scaling.py) and check the rows it keeps.
+
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from test_scaling import make_scaling_fixture
+from test_output import run_newabc
+
+PRODUCT_TABLES = ("variants", "variant_sub_regions", "sub_region_media", "sub_region_applications", "sub_region_settings")
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="newabc-catalog-")
+        self.tool_path = make_scaling_fixture(self.root, 1)
+        self.catalog_path = os.path.join(self.root, "catalog.db")
+
+        # a second product, zeus (rm2000), made of the same inputs
+        data_path = os.path.join(self.tool_path, "data")
+        for file_name in os.listdir(data_path):
+            shutil.copy(os.path.join(data_path, file_name), os.path.join(data_path, file_name.replace("rm1057_athena_", "rm2000_zeus_")))
+        shutil.copytree(os.path.join(self.root, "athena", "cached-config-base"), os.path.join(self.root, "zeus", "cached-config-base"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def run_catalog(self, type_designator):
+        return run_newabc(self.tool_path, "-t", type_designator, "--catalog=" + self.catalog_path)
+
+    def product_rows(self, product_name):
+        """
+        Return:
+            {table: sorted rows of product_name}, without the products.updated_at time
+        """
+        connection = sqlite3.connect(self.catalog_path)
+        try:
+            rows = {"products": connection.execute("SELECT product_name, product_nick_name, type_designator FROM products WHERE product_name = ?",
+                                                   (product_name,)).fetchall()}
+            for table in PRODUCT_TABLES:
+                rows[table] = sorted(connection.execute("SELECT * FROM %s WHERE product_name = ?" % table, (product_name,)).fetchall())
+        finally:
+            connection.close()
+        return rows
+
+    def test_runs_replace_the_rows_of_their_product_only(self):
+        self.assertEqual(self.run_catalog("rm1057").returncode, 0)
+        athena_rows = self.product_rows("athena")
+        self.assertEqual(athena_rows["products"], [("athena", "athena_ds", "rm1057")])
+        for table in PRODUCT_TABLES:
+            self.assertTrue(athena_rows[table], "no %s rows" % table)
+
+        self.assertEqual(self.run_catalog("rm2000").returncode, 0)
+        zeus_rows = self.product_rows("zeus")
+        self.assertEqual(zeus_rows["products"], [("zeus", "zeus_ds", "rm2000")])
+        self.assertEqual(dict((table, len(rows)) for table, rows in zeus_rows.items()),
+                         dict((table, len(rows)) for table, rows in athena_rows.items()))
+
+        # the same product again: its rows are replaced, not added, the other product keeps its rows
+        self.assertEqual(self.run_catalog("rm1057").returncode, 0)
+        self.assertEqual(self.product_rows("athena"), athena_rows)
+        self.assertEqual(self.product_rows("zeus"), zeus_rows)
+
+    def test_failed_run_keeps_the_previous_rows(self):
+        self.assertEqual(self.run_catalog("rm1057").returncode, 0)
+        athena_rows = self.product_rows("athena")
+
+        # an application missing from the application list fails a config-set, after other rows are inserted
+        content_path = os.path.join(self.tool_path, "data", "rm1057_athena_ds_content_configure_data.txt")
+        with open(content_path) as f:
+            lines = f.read().splitlines()
+        with open(content_path, "w") as f:
+            for line in lines:
+                if line.startswith("#PreloadedApps-") and line.endswith("/App3"):
+                    line = line[:-len("App3")] + "MissingApp"
+                f.write(line + "\n")
+        result = self.run_catalog("rm1057")
+        self.assertIn("MissingApp not in the generated application list", result.stdout)
+        self.assertNotIn("all files generated successfully", result.stdout)
+
+        self.assertEqual(self.product_rows("athena"), athena_rows)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,238 @@
+"""
+Output writers tests: run newabc.py on the scaling fixture (see test_scaling.py) and check the files it writes.
+
+    python -m unittest discover -s tests
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import newabc
+from test_scaling import make_scaling_fixture
+
+NEWABC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "newabc.py")
+
+def run_newabc(tool_path, *args):
+    """
+    Run newabc.py from tool_path, like from a real checkout.
+
+    Return:
+        subprocess.CompletedProcess, stdout and stderr as text
+    """
+    return subprocess.run([sys.executable, NEWABC, "-t", "rm1057", "-q"] + list(args), timeout=120,
+                          cwd=tool_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+def read_archive(archive_path):
+    """
+    Return:
+        members: [(member name, data), ...] in archive order
+    """
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as archive:
+            return [(name, archive.read(name)) for name in archive.namelist()]
+    with tarfile.open(archive_path) as archive:
+        return [(info.name, archive.extractfile(info).read()) for info in archive.getmembers()]
+
+def read_output_folder(output_path):
+    """
+    Return:
+        files: {path relative to output_path, "/" separated: data}
+    """
+    files = {}
+    for folder, dirs, file_names in os.walk(output_path):
+        for file_name in file_names:
+            file_path = os.path.join(folder, file_name)
+            with open(file_path, "rb") as f:
+                files[os.path.relpath(file_path, output_path).replace(os.sep, "/")] = f.read()
+    return files
+
+def generated_files(output_path, product_name="athena"):
+    """
+    Return:
+        files: {"athena/config-sets/...": data, "athena/variants/...": data}, what the tool wrote under output_path
+    """
+    files = {}
+    for folder in ("config-sets", "variants"):
+        for path, data in read_output_folder(os.path.join(output_path, product_name, folder)).items():
+            files["%s/%s/%s" % (product_name, folder, path)] = data
+    return files
+
+class ArchiveOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="newabc-output-")
+        self.tool_path = make_scaling_fixture(self.root, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def run_archive(self, archive_name, *args):
+        archive_path = os.path.join(self.root, archive_name)
+        result = run_newabc(self.tool_path, "-a", archive_path, *args)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        with open(archive_path, "rb") as f:
+            return archive_path, f.read()
+
+    def test_same_inputs_give_the_same_archive(self):
+        for archive_name in ("out.zip", "out.tar", "out.tar.gz", "out.tar.bz2", "out.tar.xz"):
+            first = self.run_archive(archive_name, "-j", "1")[1]
+            second = self.run_archive(archive_name, "-j", "1")[1]
+            self.assertEqual(first, second, "%s differs from run to run" % archive_name)
+
+    def test_archive_has_the_files_of_the_output_folder_and_a_manifest(self):
+        self.assertEqual(run_newabc(self.tool_path, "-o", self.root, "-j", "1").returncode, 0)
+        expected_files = generated_files(self.root)
+        self.assertTrue(expected_files)
+
+        for archive_name, jobs in (("out.zip", "1"), ("out.tar.gz", "1"), ("out.zip", "4"), ("out.tar.xz", "4")):
+            archive_path = self.run_archive(archive_name, "-j", jobs)[0]
+            members = read_archive(archive_path)
+
+            # manifest.json comes last and lists every other member
+            self.assertEqual(members[-1][0], "manifest.json")
+            manifest = json.loads(members[-1][1].decode("utf-8"))
+            files = dict(members[:-1])
+            self.assertEqual(len(files), len(members) - 1, "duplicated members")
+            self.assertEqual(files, expected_files)
+            self.assertEqual([entry["path"] for entry in manifest["files"]], sorted(files))
+            for entry in manifest["files"]:
+                self.assertEqual(entry["size"], len(files[entry["path"]]))
+                self.assertEqual(entry["sha256"], hashlib.sha256(files[entry["path"]]).hexdigest())
+
+    def test_failed_run_leaves_no_archive(self):
+        # an application missing from the application list fails a config-set, after other files are written
+        content_path = os.path.join(self.tool_path, "data", "rm1057_athena_ds_content_configure_data.txt")
+        with open(content_path) as f:
+            lines = f.read().splitlines()
+        with open(content_path, "w") as f:
+            for line in lines:
+                if line.startswith("#PreloadedApps-") and line.endswith("/App3"):
+                    line = line[:-len("App3")] + "MissingApp"
+                f.write(line + "\n")
+
+        fixture_names = sorted(os.listdir(self.root))
+        for archive_name in ("out.zip", "out.tar.gz"):
+            result = run_newabc(self.tool_path, "-j", "1", "-a", os.path.join(self.root, archive_name))
+            self.assertIn("MissingApp not in the generated application list", result.stdout)
+            # neither the archive nor its .tmp (or any spool) is left next to the inputs
+            self.assertEqual(sorted(os.listdir(self.root)), fixture_names)
+
+class WriteBehindOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="newabc-output-")
+        self.saved_fsync = newabc.FSYNC
+
+    def tearDown(self):
+        newabc.FSYNC = self.saved_fsync
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_write_blocks_while_the_queue_is_full(self):
+        is_disk_free = threading.Event()
+        writer = newabc.WriteBehindOutput(self.root, 1, 1)
+        write_file = writer.write_file
+        def slow_write_file(relative_path, data):
+            is_disk_free.wait()
+            write_file(relative_path, data)
+        writer.write_file = slow_write_file
+
+        writer.write("a.xml", "a")    # taken by the writer thread, which waits for the disk
+        while not writer.queue.empty():
+            time.sleep(0.001)
+        writer.write("b.xml", "b")    # fills the queue of 1
+        render = threading.Thread(target=writer.write, args=("c.xml", "c"))
+        render.start()
+        render.join(0.2)
+        self.assertTrue(render.is_alive(), "write() did not wait for room in the queue")
+
+        is_disk_free.set()
+        render.join(5)
+        self.assertFalse(render.is_alive())
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.root)), ["a.xml", "b.xml", "c.xml"])
+        self.assertEqual(writer.threads, [])
+
+    def test_abort_drops_the_queued_files_and_stops_the_threads(self):
+        is_disk_free = threading.Event()
+        writer = newabc.WriteBehindOutput(self.root, 2, 8)
+        write_file = writer.write_file
+        def slow_write_file(relative_path, data):
+            is_disk_free.wait()
+            write_file(relative_path, data)
+        writer.write_file = slow_write_file
+
+        for i in range(8):
+            writer.write("%d.xml" % i, "x")
+        threads = list(writer.threads)
+        threading.Timer(0.1, is_disk_free.set).start()
+        writer.abort()
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertLess(len(os.listdir(self.root)), 8)
+
+    def fsync_count(self, fsync, paths):
+        """
+        Return:
+            (os.fsync calls by the writes, os.fsync calls by close())
+        """
+        newabc.FSYNC = fsync
+        writer = newabc.WriteBehindOutput(self.root, 2, 4)
+        with mock.patch("os.fsync", wraps=os.fsync) as os_fsync:
+            for relative_path in paths:
+                writer.write(relative_path, "x")
+            writer.stop_threads()
+            write_count = os_fsync.call_count
+            writer.close()
+        return write_count, os_fsync.call_count - write_count
+
+    def test_fsync(self):
+        paths = [os.path.join("athena", "variants", "%d.xml" % i) for i in range(5)]
+        self.assertEqual(self.fsync_count("none", paths), (0, 0))
+        self.assertEqual(self.fsync_count("file", paths), (5, 0))
+        self.assertEqual(self.fsync_count("end", paths), (0, 5 + 1)) # the files and their folder
+
+class WriteBehindRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="newabc-output-")
+        self.tool_path = make_scaling_fixture(self.root, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def generate(self, *args):
+        for folder in ("config-sets", "variants"):
+            shutil.rmtree(os.path.join(self.root, "athena", folder), ignore_errors=True)
+        result = run_newabc(self.tool_path, *args)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        return generated_files(self.root)
+
+    def test_options_give_the_same_files(self):
+        expected_files = self.generate("--io-threads=0")
+        self.assertTrue(expected_files)
+        for args in (["-j", "4", "--io-threads=1", "--io-queue=1"], ["-j", "4", "--io-threads=4", "--io-queue=1"],
+                     ["--fsync=file"], ["--fsync=end"], ["--io-threads=0", "--fsync=end"]):
+            self.assertEqual(self.generate(*args), expected_files, args)
+
+    def test_write_error_fails_the_run(self):
+        # a file where the variants folder should be
+        with open(os.path.join(self.root, "athena", "variants"), "w") as f:
+            f.write("not a folder\n")
+        for args in (["-j", "4", "--io-queue=1"], ["-j", "1"]):
+            result = run_newabc(self.tool_path, *args)
+            self.assertEqual(result.returncode, 1, result.stdout + result.stderr)
+            self.assertEqual(result.stdout.count("Error: [WriteBehindOutput]"), 1, result.stdout)
+            self.assertNotIn("all files generated successfully", result.stdout)
+
+if __name__ == "__main__":
+    unittest.main()
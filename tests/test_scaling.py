@@ -0,0 +1,248 @@
+"""
+Scaling tests: run every parse / render stage of newabc.py on synthetic inputs of SIZES sizes and
+check that run time and peak memory grow near linearly with the input size.
+
+The growth exponent log(value2/value1)/log(size2/size1) between the two largest sizes must stay
+under MAX_GROWTH, a quadratic path coming back gives about 2.
+
+    python -m unittest discover -s tests
+"""
+import gc
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import newabc
+
+SIZES = (1, 10, 100)        # input sizes, every input grows linearly with it
+MAX_GROWTH = 1.3            # allowed growth exponent between the two largest sizes, 1.0 is linear
+MIN_SECONDS = 0.001         # every stage must take at least this at the largest size, or it is too noisy to judge
+MIN_MEMORY = 256 << 10      # same for the peak memory, in bytes (tracemalloc counts don't vary from run to run)
+MIN_TIMED_SECONDS = 0.1     # fast stages are timed again and again, for at least this long, to get a stable median time
+TYPE_DESIGNATOR = "rm1057"
+PRODUCT_NAME = "athena"
+
+def make_scaling_fixture(root, scale):
+    """
+    Write a synthetic tool folder and its storage / cached-config-base next to it, with the same
+    layout as a real checkout. Every input grows linearly with scale:
+
+        4*scale countries and sub regions, 2*scale CTR codes, 200*scale variant applications,
+        10*scale media files per storage folder, 50*scale settings in Settings_PRODUCT_scaling.xml
+        (only read by the settings stage, the sub regions cascade has a fixed size)
+
+    Args:
+        root: empty folder
+        scale: 1, 10, 100 ...
+    Return:
+        tool_path: root/tool/abc (the folder the tool runs from)
+    """
+    tool_path = os.path.join(root, "tool", "abc")
+    product_name = PRODUCT_NAME
+
+    def write(file_path, lines):
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    write(os.path.join(tool_path, "template", "{SubRegion}-config-data.xml"), [
+        '<ConfigurationData name="{configuration_name}" id="{config_id}" type="{config_type}" configName="{config_name}" index="{config_index}">',
+        '{VideoList}{MusicList}{WallpaperList}{RingtoneList}',
+        '{VariantPreloadApplicationsList}{VariantMenuApplicationsList}{VariantHomeScreenList}',
+        '{VariantSettings}',
+        '</ConfigurationData>'])
+    write(os.path.join(tool_path, "template", "{ProductName}_{CTR}.xml"), [
+        '<Variant package="{variant_package_name}" ctr="{variant_ctr}" name="{variant_name}" index="{variant_index}" version="{variant_version}"'
+        ' platform="{platform}" product="{product_name}" typeDesignator="{type_designator}" countrySet="{country_set}" hasSdCard="{has_sdcard}">',
+        '{variant_config_sets_content}</Variant>'])
+
+    countries = ["C%04d" % i for i in range(4 * scale)]
+    write(os.path.join(tool_path, "cfg", "country_mcc.txt"),
+          ["EURO COMMON:E_C:216,226"] + ["COUNTRY%s:%s:%d" % (country, country, 300 + i) for i, country in enumerate(countries)])
+
+    ctr_codes = ["059%04d" % i for i in range(2 * scale)]
+    codelist_lines = ["# scaling check codelist"]
+    codelist_lines += ["MV %d %s 9G-EURO RM-1057 NDT EURO|NO_SD|2300" % (1000 + i, ctr_code) for i, ctr_code in enumerate(ctr_codes)]
+    sub_regions = []
+    for i, ctr_code in enumerate(ctr_codes):
+        codelist_lines.append("SV %d %s RM-1057 NDT EURO COUNTRY%s,%s" % (2000 + 2 * i, ctr_code, countries[2 * i + 1], countries[2 * i]))
+        codelist_lines.append("SV %d %s RM-1057 NDT EURO %s" % (2001 + 2 * i, ctr_code, countries[2 * i]))
+        sub_regions += ["EURO:COUNTRY%s,%s" % (countries[2 * i + 1], countries[2 * i]), "EURO:" + countries[2 * i]]
+    write(os.path.join(tool_path, "data", "rm1057_%s_ds_codelist.txt" % product_name), codelist_lines)
+
+    applications = ["App%d" % i for i in range(200 * scale)]
+    write(os.path.join(root, product_name, "cached-config-base", "config-base.xml"),
+          ["<VariantApplications>"] + ['<VariantApplication appName="%s" BGColor="#%06d" />' % (app, i) for i, app in enumerate(applications)] + ["</VariantApplications>"])
+
+    for media_folder, extension in (("videos", "mp4"), ("audio", "mp3"), ("images", "jpg")):
+        for i in range(10 * scale):
+            write(os.path.join(root, "storage", "common", media_folder, "%s%d.%s" % (media_folder, i, extension)), [""])
+    os.makedirs(os.path.join(root, "storage", product_name, "audio"))
+
+    content_lines = ["$ scaling check content configure data"]
+    content_lines += ["#Videos-PRODUCT-videos0.mp4/videos1.mp4", "#Videos-MV>EURO-videos2.mp4/missing.mp4"]
+    content_lines += ["#Music-PRODUCT-audio0.mp3", "#Music-MV>EURO-audio1.mp3"]
+    content_lines += ["#LockscreenWallpaper-PRODUCT-images0.jpg", "#LockscreenWallpaper-MV>EURO-images1.jpg"]
+    content_lines += ["#RingingTones-PRODUCT-audio2.mp3", "#RingingTones-MV>EURO-audio3.mp3"]
+    for i, sub_region in enumerate(sub_regions):
+        content_lines.append("#PreloadedApps-SV>%s-%s/%s" % (sub_region, "/".join(applications[-10:]), applications[i]))
+        content_lines.append("#Menu-SV>%s-%s(#ff0000)/%s(#00ff00)" % (sub_region, applications[-1 - i], applications[i]))
+        content_lines.append("#Home-SV>%s-%s(1,2,3,4,5)" % (sub_region, applications[-1 - i]))
+    write(os.path.join(tool_path, "data", "rm1057_%s_ds_content_configure_data.txt" % product_name), content_lines)
+
+    settings_path = os.path.join(tool_path, "cfg", "Settings")
+    def write_settings(file_name, settings):
+        write(os.path.join(settings_path, file_name),
+              ["<VariantSettings>"] + ['    <VariantSetting packageId="com.example" settingId="%s" value="%s" />' % setting for setting in settings] + ["</VariantSettings>"])
+    write_settings("Settings_PRODUCT.xml", [("setting%d" % i, "product") for i in range(50)])
+    write_settings("Settings_DS.xml", [("setting%d" % i, "ds") for i in range(10)])
+    write_settings("Settings_MV_EURO.xml", [("setting%d" % i, "mv") for i in range(10, 20)])
+    write_settings("Settings_SV_EURO_%s.xml" % countries[0], [("setting1", "sv")])
+    write_settings("Settings_PRODUCT_scaling.xml", [("setting%d" % (i % (40 * scale)), "scaling%d" % i) for i in range(50 * scale)])
+
+    return tool_path
+
+def measure_scaling_stage(prepare, run, repeat=5):
+    """
+    Args:
+        prepare: called before each measure, not measured
+        run: the measured stage
+        repeat: least number of timed runs, more until they add up to MIN_TIMED_SECONDS
+    Return:
+        seconds: median time of the runs (the best time would drop with the number of runs, which differs between sizes)
+        peak_memory: peak of the memory allocated by the stage, in bytes
+    """
+    times = []
+    while len(times) < repeat or sum(times) < MIN_TIMED_SECONDS:
+        prepare()
+        # like timeit: the garbage collector passes depend on everything allocated so far, not on the stage
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    seconds = sorted(times)[len(times) // 2]
+
+    prepare()
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return seconds, peak_memory
+
+def growth(values):
+    """
+    Return:
+        growth exponent between the two largest sizes
+    """
+    return math.log(float(values[-1]) / values[-2]) / math.log(float(SIZES[-1]) / SIZES[-2])
+
+def prepare_parse():
+    newabc.reset_run_state()
+
+class RecordOutput(newabc.OutputWriter):
+    """
+    Keep the manifest of the generated files without writing them: file creation time depends
+    on the filesystem, not on newabc.py, and would swamp the render stages.
+    """
+    def write(self, relative_path, text):
+        self.record(relative_path, text.encode("utf-8"))
+
+def prepare_render():
+    newabc.reset_run_state()
+    newabc.OUTPUT_WRITER = RecordOutput(False)
+    newabc.get_generated_variant_applications_list_info(TYPE_DESIGNATOR)
+
+STAGES = [
+    ("get_generated_variant_applications_list_info", prepare_parse,
+     lambda: newabc.get_generated_variant_applications_list_info(TYPE_DESIGNATOR)),
+    ("get_content_configure_data_info", prepare_parse,
+     lambda: newabc.get_content_configure_data_info(newabc.find_codelist_and_content_configure_data_files(TYPE_DESIGNATOR)[3])),
+    ("get_codelist_info", prepare_parse,
+     lambda: newabc.get_codelist_info(newabc.find_codelist_and_content_configure_data_files(TYPE_DESIGNATOR)[2])),
+    ("variant_settings_collect", prepare_parse,
+     lambda: newabc.variant_settings_collect(TYPE_DESIGNATOR, "scaling", "scaling_ds", "SV>EURO_SCALING")),
+    ("generate_config_sets_files", prepare_render,
+     lambda: newabc.generate_config_sets_files(TYPE_DESIGNATOR)),
+    ("generate_variants_files", prepare_render,
+     lambda: newabc.generate_variants_files(TYPE_DESIGNATOR)),
+]
+
+class ScalingTest(unittest.TestCase):
+    """
+    All stages are measured once, on every size, by setUpClass; each test checks one stage.
+    """
+    PATH_GLOBALS = ("TOOL_PATH", "OUTPUT", "TEMPLATE_PATH", "STORAGE_PATH", "COUNTRY_MCC_FILE", "SETTINGS_PATH", "QUIET")
+
+    @classmethod
+    def setUpClass(cls):
+        cls.saved_globals = dict((name, getattr(newabc, name)) for name in cls.PATH_GLOBALS)
+        cls.scratch_path = tempfile.mkdtemp(prefix="newabc-scaling-")
+        cls.results = {}
+        try:
+            newabc.QUIET = True
+            for scale in SIZES:
+                scale_root = os.path.join(cls.scratch_path, "x%d" % scale)
+                newabc.TOOL_PATH = make_scaling_fixture(scale_root, scale)
+                newabc.OUTPUT = scale_root
+                newabc.TEMPLATE_PATH = os.path.join(newabc.TOOL_PATH, "template")
+                newabc.STORAGE_PATH = os.path.join(scale_root, "storage")
+                newabc.COUNTRY_MCC_FILE = os.path.join(newabc.TOOL_PATH, "cfg", "country_mcc.txt")
+                newabc.SETTINGS_PATH = os.path.join(newabc.TOOL_PATH, "cfg", "Settings")
+                for name, prepare, run in STAGES:
+                    cls.results.setdefault(name, []).append(measure_scaling_stage(prepare, run))
+        finally:
+            cls.restore()
+
+    @classmethod
+    def restore(cls):
+        for name, value in cls.saved_globals.items():
+            setattr(newabc, name, value)
+        newabc.reset_run_state()
+        shutil.rmtree(cls.scratch_path, ignore_errors=True)
+
+    def assert_linear(self, name):
+        seconds = [measure[0] for measure in self.results[name]]
+        memory = [measure[1] for measure in self.results[name]]
+        # a stage under the floors would be judged on noise: its fixture input must grow
+        self.assertGreaterEqual(seconds[-1], MIN_SECONDS, "%s too fast to judge at size %d: %s" % (name, SIZES[-1], seconds))
+        self.assertGreaterEqual(memory[-1], MIN_MEMORY, "%s too small to judge at size %d: %s" % (name, SIZES[-1], memory))
+        seconds_growth = growth(seconds)
+        memory_growth = growth(memory)
+        worst_growth = max(seconds_growth, memory_growth)
+        self.assertLessEqual(worst_growth, MAX_GROWTH,
+                             "%s no more linear: seconds %s (growth %s), peak memory %s (growth %s)" % (name, seconds, seconds_growth, memory, memory_growth))
+
+    def test_get_generated_variant_applications_list_info(self):
+        self.assert_linear("get_generated_variant_applications_list_info")
+
+    def test_get_content_configure_data_info(self):
+        self.assert_linear("get_content_configure_data_info")
+
+    def test_get_codelist_info(self):
+        self.assert_linear("get_codelist_info")
+
+    def test_variant_settings_collect(self):
+        self.assert_linear("variant_settings_collect")
+
+    def test_generate_config_sets_files(self):
+        self.assert_linear("generate_config_sets_files")
+
+    def test_generate_variants_files(self):
+        self.assert_linear("generate_variants_files")
+
+if __name__ == "__main__":
+    unittest.main()
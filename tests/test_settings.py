@@ -0,0 +1,74 @@
+"""
+Settings files reader tests.
+
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import newabc
+
+SETTINGS_FILES = {
+    "lf.xml": b'<VariantSettings>\n'
+              b'    <VariantSetting packageId="com.a" settingId="s1" value="v1" />\n'
+              b'    <!-- <VariantSetting packageId="com.a" settingId="s2" value="commented" /> -->\n'
+              b'\n'
+              b'    <VariantSetting packageId="com.b" settingId="s3" value="v3 with spaces" />\n'
+              b'</VariantSettings>\n',
+    "crlf.xml": b'<VariantSettings>\r\n'
+                b'    <VariantSetting packageId="com.a" settingId="s1" value="v1" />\r\n'
+                b'\t<VariantSetting   packageId="com.b"  settingId="s2"  value="v2"   />  \r\n'
+                b'</VariantSettings>\r\n',
+    "no_final_newline.xml": b'<VariantSettings>\n'
+                            b'    <VariantSetting packageId="com.a" settingId="s1" value="v1" />\n'
+                            b'    <VariantSetting packageId="com.a" settingId="s2" value="v2" />',
+    "two_records_on_a_line.xml": b'<VariantSettings>\n'
+                                 b'<VariantSetting packageId="com.a" settingId="s1" value="v1" /><VariantSetting packageId="com.a" settingId="s2" value="v2" />\n'
+                                 b'    <VariantSetting packageId="com.a" settingId="s3" value="v3" />\n'
+                                 b'</VariantSettings>\n',
+    "utf8.xml": u'<VariantSettings>\n'
+                u'    <VariantSetting packageId="com.a" settingId="s1" value="été" />\n'
+                u'</VariantSettings>\n'.encode("utf-8"),
+    "empty.xml": b'',
+}
+
+class VariantSettingRecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_mmap_min_size = newabc.MMAP_MIN_SIZE
+        self.folder = tempfile.mkdtemp(prefix="newabc-settings-")
+        for file_name, data in SETTINGS_FILES.items():
+            with open(os.path.join(self.folder, file_name), "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        newabc.MMAP_MIN_SIZE = self.saved_mmap_min_size
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def read_records(self, file_name, mmap_min_size):
+        newabc.MMAP_MIN_SIZE = mmap_min_size
+        return list(newabc.iter_variant_setting_records(os.path.join(self.folder, file_name)))
+
+    def test_line_and_mmap_readers_give_the_same_records(self):
+        for file_name in sorted(SETTINGS_FILES):
+            line_records = self.read_records(file_name, 0)
+            mmap_records = self.read_records(file_name, 1)
+            self.assertEqual(line_records, mmap_records, file_name)
+
+    def test_records(self):
+        self.assertEqual([record[1:] for record in self.read_records("lf.xml", 0)],
+                         [("com.a", "s1", "v1"), ("com.a", "s2", "commented"), ("com.b", "s3", "v3 with spaces")])
+        self.assertEqual(self.read_records("crlf.xml", 0),
+                         [('<VariantSetting packageId="com.a" settingId="s1" value="v1" />', "com.a", "s1", "v1"),
+                          ('<VariantSetting   packageId="com.b"  settingId="s2"  value="v2"   />', "com.b", "s2", "v2")])
+        self.assertEqual([record[2:] for record in self.read_records("no_final_newline.xml", 0)], [("s1", "v1"), ("s2", "v2")])
+        self.assertEqual(len(self.read_records("two_records_on_a_line.xml", 0)), 2)
+        self.assertEqual(self.read_records("utf8.xml", 0)[0][3], u"été")
+        self.assertEqual(self.read_records("empty.xml", 0), [])
+
+if __name__ == "__main__":
+    unittest.main()
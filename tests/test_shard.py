@@ -0,0 +1,130 @@
+"""
+Sharding tests: run every --shard=<i>/<N> of the scaling fixture (see test_scaling.py) in its own
+process, like on separate build nodes, then verify and merge them with --merge-manifests.
+
+    python -m unittest discover -s tests
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from test_scaling import make_scaling_fixture
+from test_output import NEWABC, generated_files, read_archive, run_newabc
+
+SHARD_COUNT = 3
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="newabc-shard-")
+        self.tool_path = make_scaling_fixture(self.root, 2)
+        self.manifest_folder = os.path.join(self.root, "athena")
+
+        # the files of a run without shards, what the shards together must give
+        result = run_newabc(self.tool_path)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.expected_files = generated_files(self.root)
+        for folder in ("config-sets", "variants"):
+            shutil.rmtree(os.path.join(self.manifest_folder, folder))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def run_shards(self, *args, **kwargs):
+        """
+        Run the shards at the same time, one process each.
+
+        Return:
+            manifest_paths: [manifest-shard-1-of-N.json, ...]
+        """
+        shard_count = kwargs.get("shard_count", SHARD_COUNT)
+        processes = []
+        for shard_index in range(1, shard_count + 1):
+            shard_args = [arg.format(shard=shard_index) for arg in args]
+            processes.append(subprocess.Popen([sys.executable, NEWABC, "-t", "rm1057", "-q", "--shard=%d/%d" % (shard_index, shard_count)] + shard_args,
+                                              cwd=self.tool_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True))
+        for process in processes:
+            output = process.communicate()[0]
+            self.assertEqual(process.returncode, 0, output)
+        return [os.path.join(self.manifest_folder, "manifest-shard-%d-of-%d.json" % (shard_index, shard_count))
+                for shard_index in range(1, shard_count + 1)]
+
+    def merge(self, manifest_paths):
+        return run_newabc(self.tool_path, "--merge-manifests=" + os.path.join(self.root, "merged.json"), *manifest_paths)
+
+    def assert_merge_fails(self, manifest_paths, message):
+        result = self.merge(manifest_paths)
+        self.assertEqual(result.returncode, 1, result.stdout + result.stderr)
+        self.assertIn("Error: [merge_shard_manifests]", result.stdout)
+        self.assertIn(message, result.stdout)
+
+    def test_shards_give_the_files_of_one_run(self):
+        manifest_paths = self.run_shards()
+        self.assertEqual(generated_files(self.root), self.expected_files)
+
+        work_items = []
+        for manifest_path in manifest_paths:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self.assertTrue(manifest["work_items"], "shard %d got no work" % manifest["shard"])
+            work_items += manifest["work_items"]
+        self.assertEqual(len(work_items), manifest["work_item_count"])
+
+        result = self.merge(manifest_paths)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        with open(os.path.join(self.root, "merged.json")) as f:
+            merged = json.load(f)
+        self.assertEqual([entry["path"].replace(os.sep, "/") for entry in merged["files"]], sorted(self.expected_files))
+
+    def test_missing_shard(self):
+        manifest_paths = self.run_shards()
+        self.assert_merge_fails(manifest_paths[:1] + manifest_paths[2:], "expected shards 1..%d once each" % SHARD_COUNT)
+
+    def test_tampered_file(self):
+        manifest_paths = self.run_shards()
+        with open(manifest_paths[1]) as f:
+            file_path = os.path.join(self.root, json.load(f)["files"][0]["path"])
+        with open(file_path, "a") as f:
+            f.write("<!-- edited -->\n")
+        self.assert_merge_fails(manifest_paths, "does not match its shard manifest")
+
+    def test_mismatched_plan(self):
+        manifest_paths = self.run_shards()
+
+        # shard 2 runs again on other inputs: one more CTR
+        codelist_path = os.path.join(self.tool_path, "data", "rm1057_athena_ds_codelist.txt")
+        with open(codelist_path, "a") as f:
+            f.write("MV 1999 0599999 9G-EURO RM-1057 NDT EURO|NO_SD|2300\n")
+            f.write("SV 2999 0599999 RM-1057 NDT EURO C0000\n")
+        result = run_newabc(self.tool_path, "--shard=2/%d" % SHARD_COUNT)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assert_merge_fails(manifest_paths, "shards come from different plans")
+
+    def test_archive_shards(self):
+        manifest_paths = self.run_shards("-a", os.path.join(self.root, "out-{shard}.zip"))
+        result = self.merge(manifest_paths)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+
+        files = {}
+        for shard_index in range(1, SHARD_COUNT + 1):
+            files.update((name, data) for name, data in read_archive(os.path.join(self.root, "out-%d.zip" % shard_index)) if name != "manifest.json")
+        self.assertEqual(files, self.expected_files)
+
+        # one member of shard 2 edited inside its archive
+        archive_path = os.path.join(self.root, "out-2.zip")
+        members = read_archive(archive_path)
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            for i, (name, data) in enumerate(members):
+                archive.writestr(name, data + b"<!-- edited -->\n" if i == 0 else data)
+        self.assert_merge_fails(manifest_paths, "does not match its shard manifest")
+
+        os.remove(archive_path)
+        self.assert_merge_fails(manifest_paths, "out-2.zip is missing")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Task graph tests: dependency order, dynamic spawn and failure handling of run_task_graph.
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import newabc
+from newabc import Task
+
+class TaskGraphTest(unittest.TestCase):
+
+    def test_dependencies_and_spawn(self):
+        order = []
+        lock = threading.Lock()
+
+        def step(name, *args):
+            with lock:
+                order.append(name)
+            return name
+
+        def spawn(result):
+            return [Task("render:%d" % i, lambda parsed, i=i: step("render:%d" % i, parsed), deps=["parse"]) for i in range(3)]
+
+        finished_tasks = newabc.run_task_graph([Task("parse", lambda: step("parse"), spawn=spawn),
+                                                Task("summary", lambda parsed: step("summary", parsed), deps=["parse"])], 4)
+
+        self.assertEqual(sorted(finished_tasks), ["parse", "render:0", "render:1", "render:2", "summary"])
+        self.assertEqual(order[0], "parse")
+        self.assertEqual(finished_tasks["render:1"].result, "render:1")
+
+    def test_failed_task_cancels_the_queued_tasks(self):
+        started = []
+        lock = threading.Lock()
+
+        def sibling():
+            with lock:
+                started.append(1)
+            time.sleep(0.001)
+
+        def failing():
+            time.sleep(0.01)
+            sys.exit(1)
+
+        tasks = [Task("a-failing", failing)] + [Task("b-sibling:%04d" % i, sibling) for i in range(2000)]
+        with self.assertRaises(SystemExit):
+            newabc.run_task_graph(tasks, 2)
+
+        self.assertLess(len(started), 2000)
+
+if __name__ == "__main__":
+    unittest.main()